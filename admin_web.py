@@ -8,4 +8,11 @@ from app.webadmin.server import app
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host=ADMIN_WEB_BIND, port=ADMIN_WEB_PORT, reload=False)
+    uvicorn.run(
+        app,
+        host=ADMIN_WEB_BIND,
+        port=ADMIN_WEB_PORT,
+        reload=False,
+        loop="uvloop",
+        http="httptools",
+    )
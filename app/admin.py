@@ -1,8 +1,9 @@
+import asyncio
+
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
-from datetime import datetime
 
 from .config import CURRENCY, ADMIN_IDS
 from .db import db_execute
@@ -12,15 +13,25 @@ from .utils import is_admin
 
 router = Router()
 
+_PENDING_STATUS = "در انتظار تایید پرداخت"
+_ACTION_STATUS = {
+    "approve": "پرداخت تایید شد",
+    "reject": "رد شد (نیاز به پیگیری)",
+    "delivered": "تحویل شد",
+}
+
 @router.message(Command("admin"))
 async def on_admin_cmd(m: Message):
     if not is_admin(m.from_user.id, ADMIN_IDS):
         await m.answer("دسترسی ادمین ندارید.")
         return
-    pending = db_execute(
-        "SELECT COUNT(*) AS c FROM orders WHERE status='در انتظار تایید پرداخت'",
+    row = await asyncio.to_thread(
+        db_execute,
+        "SELECT COUNT(*) AS c FROM orders WHERE status=?",
+        (_PENDING_STATUS,),
         fetchone=True,
-    )["c"]
+    )
+    pending = row["c"]
     text = (
         "👮‍♂️ پنل ادمین (ساده)\n"
         f"سفارش‌های منتظر تایید پرداخت: <b>{pending}</b>\n\n"
@@ -36,19 +47,20 @@ async def on_admin_pending(m: Message):
     if not is_admin(m.from_user.id, ADMIN_IDS):
         await m.answer("دسترسی ادمین ندارید.")
         return
-    rows = db_execute(
-        "SELECT id, plan_title, price, status, created_at FROM orders WHERE status='در انتظار تایید پرداخت' ORDER BY id DESC LIMIT 10",
+    rows = await asyncio.to_thread(
+        db_execute,
+        "SELECT id, plan_title, price, status, strftime('%Y-%m-%d %H:%M:%S', created_at) AS created_at "
+        "FROM orders WHERE status=? ORDER BY id DESC LIMIT 10",
+        (_PENDING_STATUS,),
         fetchall=True,
     )
     if not rows:
         await m.answer("هیچ سفارش منتظر تایید وجود ندارد.")
         return
-    lines = []
-    for r in rows:
-        created = r["created_at"].replace("T", " ")
-        lines.append(
-            f"– #{r['id']} | {r['plan_title']} | {r['price']} {CURRENCY}\n  وضعیت: <b>{r['status']}</b> | {created}"
-        )
+    lines = [
+        f"– #{r['id']} | {r['plan_title']} | {r['price']} {CURRENCY}\n  وضعیت: <b>{r['status']}</b> | {r['created_at']}"
+        for r in rows
+    ]
     await m.answer("🟡 سفارش‌های منتظر تایید:\n\n" + "\n".join(lines))
 
 @router.message(Command("search"))
@@ -61,7 +73,12 @@ async def on_admin_search(m: Message):
         await m.answer("استفاده درست: /search 123")
         return
     oid = int(parts[1])
-    row = db_execute("SELECT * FROM orders WHERE id=?", (oid,), fetchone=True)
+    row = await asyncio.to_thread(
+        db_execute,
+        "SELECT *, strftime('%Y-%m-%d %H:%M:%S', created_at) AS created_display FROM orders WHERE id=?",
+        (oid,),
+        fetchone=True,
+    )
     if not row:
         await m.answer("سفارش یافت نشد.")
         return
@@ -70,7 +87,7 @@ async def on_admin_search(m: Message):
         f"مشتری: <code>{row['user_id']}</code> @{row['username'] or '—'}\n"
         f"پلن: {row['plan_title']} | مبلغ: {row['price']} {CURRENCY}\n"
         f"وضعیت: {row['status']}\n"
-        f"ایجاد: {row['created_at'].replace('T',' ')}\n"
+        f"ایجاد: {row['created_display']}\n"
     )
     await m.answer(text, reply_markup=kb_admin_actions(row["id"]))
 
@@ -80,9 +97,12 @@ async def on_admin_action(c: CallbackQuery, state: FSMContext):
         await c.answer("دسترسی ادمین ندارید.", show_alert=True)
         return
 
-    _, action, oid_str = c.data.split(":")
+    # the router filter guarantees the "admin:" prefix
+    action, oid_str = c.data[6:].split(":", 1)
     order_id = int(oid_str)
-    row = db_execute("SELECT * FROM orders WHERE id=?", (order_id,), fetchone=True)
+    row = await asyncio.to_thread(
+        db_execute, "SELECT user_id FROM orders WHERE id=?", (order_id,), fetchone=True
+    )
     if not row:
         await c.answer("سفارش یافت نشد.", show_alert=True)
         return
@@ -94,28 +114,26 @@ async def on_admin_action(c: CallbackQuery, state: FSMContext):
         await c.answer()
         return
 
-    new_status = None
-    if action == "approve":
-        new_status = "پرداخت تایید شد"
-    elif action == "reject":
-        new_status = "رد شد (نیاز به پیگیری)"
-    elif action == "delivered":
-        new_status = "تحویل شد"
+    new_status = _ACTION_STATUS.get(action)
 
     if new_status:
-        db_execute(
-            "UPDATE orders SET status=?, updated_at=? WHERE id=?",
-            (new_status, datetime.now().isoformat(timespec="seconds"), order_id),
+        await asyncio.to_thread(
+            db_execute,
+            "UPDATE orders SET status=?, updated_at=strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime') WHERE id=?",
+            (new_status, order_id),
         )
         await c.answer("وضعیت به‌روزرسانی شد.")
-        try:
-            await c.bot.send_message(
+        # notify the customer and refresh the admin keyboard in parallel; a failed
+        # notification must not block the admin, so exceptions are swallowed
+        await asyncio.gather(
+            c.bot.send_message(
                 row["user_id"],
                 f"وضعیت سفارش #{order_id} به «<b>{new_status}</b>» تغییر کرد.",
-            )
-        except Exception:
-            pass
-        await c.message.edit_reply_markup(reply_markup=kb_admin_actions(order_id))
+                disable_notification=True,
+            ),
+            c.message.edit_reply_markup(reply_markup=kb_admin_actions(order_id)),
+            return_exceptions=True,
+        )
 
 @router.message(AdminStates.waiting_message)
 async def on_admin_send_message(m: Message, state: FSMContext):
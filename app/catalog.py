@@ -1,21 +1,32 @@
 from __future__ import annotations
 
 import os
+import re
+import time
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Sequence
+from typing import Mapping, Sequence
 
-from dotenv import load_dotenv, set_key
+from dotenv import load_dotenv
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
 ENV_FILE = ROOT_DIR / ".env"
 _ENV_FILE_MTIME: float | None = None
+_ENV_LAST_CHECK: float = 0.0
+# .env only changes through set_variant_settings (which forces a reload), so
+# checking its mtime once a second is plenty.
+_ENV_CHECK_INTERVAL = 1.0
 
 
 def _refresh_env(force: bool = False) -> None:
     """Reload .env values into the current process when the file changes."""
 
-    global _ENV_FILE_MTIME
+    global _ENV_FILE_MTIME, _ENV_LAST_CHECK
+    now = time.monotonic()
+    if not force and now - _ENV_LAST_CHECK < _ENV_CHECK_INTERVAL:
+        return
+    _ENV_LAST_CHECK = now
     try:
         mtime = ENV_FILE.stat().st_mtime
     except FileNotFoundError:
@@ -25,7 +36,7 @@ def _refresh_env(force: bool = False) -> None:
         _ENV_FILE_MTIME = mtime
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class VariantMeta:
     code: str
     group: str
@@ -38,27 +49,57 @@ class VariantMeta:
     unavailable_label: str | None = None
 
 
+@dataclass(frozen=True, slots=True)
+class VariantView:
+    """Resolved variant: static metadata plus the current price/availability."""
+
+    code: str
+    group: str
+    display_name: str
+    button_label: str
+    price: str
+    amount: int
+    available: bool
+    availability_key: str
+    price_key: str
+    unavailable_label: str
+
+
+class _DigitsOnly(dict):
+    """``str.translate`` table that keeps digits (of any script) and drops the rest."""
+
+    def __missing__(self, codepoint: int) -> int | None:
+        kept = codepoint if chr(codepoint).isdigit() else None
+        self[codepoint] = kept
+        return kept
+
+
+_KEEP_DIGITS = _DigitsOnly()
+
+
 def _price_to_int(value: str) -> int:
     value = (value or "").strip()
+    if not value:
+        return 0
     if value.isdigit():
         return int(value)
     try:
-        digits = "".join(ch for ch in value if ch.isdigit())
+        digits = value.translate(_KEEP_DIGITS)
         return int(digits) if digits else 0
     except Exception:
         return 0
 
 
-def _env_value(keys: Sequence[str], default: str) -> str:
+def _env_value(keys: Sequence[str], default: str, env: Mapping[str, str | None] = os.environ) -> str:
     for key in keys:
-        value = os.getenv(key)
+        value = env.get(key)
         if value not in (None, ""):
             return value
     return default
 
 
-def _env_bool(key: str, default: bool) -> bool:
-    value = os.getenv(key)
+def _env_bool(key: str, default: bool, env: Mapping[str, str | None] = os.environ) -> bool:
+    value = env.get(key)
     if value is None or value == "":
         return default
     value = value.strip().lower()
@@ -170,6 +211,19 @@ _VARIANTS: dict[str, VariantMeta] = {
 }
 
 
+# Every env key a variant reads; lets the admin grid snapshot them in one pass.
+_ALL_KEYS: frozenset[str] = frozenset(
+    key for meta in _VARIANTS.values() for key in (*meta.price_keys, meta.availability_key)
+)
+
+
+# Labels shown for sold-out variants never change at runtime, so resolve them once.
+_EFFECTIVE_UNAVAILABLE: dict[str, str] = {
+    code: meta.unavailable_label or f"{meta.button_label} (ناموجود)"
+    for code, meta in _VARIANTS.items()
+}
+
+
 _ADMIN_ROWS: list[tuple[str, list[str]]] = [
     ("tg_premium_3m", ["tg_premium_3m"]),
     ("tg_premium_6m", ["tg_premium_6m"]),
@@ -192,60 +246,111 @@ _ADMIN_TITLES: dict[str, str] = {
 }
 
 
-def get_variant(variant_code: str) -> dict[str, object]:
+# (group code, title, variant codes) — the admin grid layout never changes at runtime.
+_ADMIN_ROWS_RESOLVED: tuple[tuple[str, str, tuple[str, ...]], ...] = tuple(
+    (group_code, _ADMIN_TITLES.get(group_code, group_code), tuple(variant_codes))
+    for group_code, variant_codes in _ADMIN_ROWS
+)
+
+
+def get_variant(variant_code: str) -> VariantView:
     _refresh_env()
+    return _get_variant_cached(variant_code, _ENV_FILE_MTIME)
+
+
+@lru_cache(maxsize=64)
+def _get_variant_cached(variant_code: str, env_mtime: float | None) -> VariantView:
+    """Resolve a variant from the environment; ``env_mtime`` only keys the cache."""
+
+    return _build_variant(variant_code, os.environ)
+
+
+def _build_variant(variant_code: str, env: Mapping[str, str | None]) -> VariantView:
     if variant_code not in _VARIANTS:
         raise KeyError(f"Unknown product variant: {variant_code}")
     meta = _VARIANTS[variant_code]
-    price_str = _env_value(meta.price_keys, meta.default_price)
+    price_str = _env_value(meta.price_keys, meta.default_price, env)
     amount = _price_to_int(price_str)
-    available = _env_bool(meta.availability_key, meta.default_available)
-    unavailable_label = meta.unavailable_label or f"{meta.button_label} (ناموجود)"
-    return {
-        "code": meta.code,
-        "group": meta.group,
-        "display_name": meta.display_name,
-        "button_label": meta.button_label,
-        "price": price_str,
-        "amount": amount,
-        "available": available,
-        "availability_key": meta.availability_key,
-        "price_key": meta.price_keys[0],
-        "unavailable_label": unavailable_label,
-    }
+    available = _env_bool(meta.availability_key, meta.default_available, env)
+    return VariantView(
+        code=meta.code,
+        group=meta.group,
+        display_name=meta.display_name,
+        button_label=meta.button_label,
+        price=price_str,
+        amount=amount,
+        available=available,
+        availability_key=meta.availability_key,
+        price_key=meta.price_keys[0],
+        unavailable_label=_EFFECTIVE_UNAVAILABLE[variant_code],
+    )
 
 
 def get_variant_price_amount(variant_code: str) -> int:
-    return int(get_variant(variant_code)["amount"])
+    return get_variant(variant_code).amount
 
 
 def get_variant_price_text(variant_code: str) -> str:
-    return str(get_variant(variant_code)["price"])
+    return get_variant(variant_code).price
 
 
 def is_variant_available(variant_code: str) -> bool:
-    return bool(get_variant(variant_code)["available"])
+    return get_variant(variant_code).available
+
+
+def _write_env_values(updates: dict[str, str]) -> None:
+    """Rewrite ``updates`` into .env in one pass, keeping every other line as-is."""
+
+    try:
+        lines = ENV_FILE.read_text(encoding="utf-8").splitlines()
+    except FileNotFoundError:
+        lines = []
+    pending = dict(updates)
+    for idx, line in enumerate(lines):
+        match = re.match(r"\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_.]*)\s*=", line)
+        if match and match.group(1) in pending:
+            key = match.group(1)
+            lines[idx] = f"{key}='{pending.pop(key)}'"
+    lines.extend(f"{key}='{value}'" for key, value in pending.items())
+    tmp_path = ENV_FILE.with_name(ENV_FILE.name + ".tmp")
+    tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    os.replace(tmp_path, ENV_FILE)
 
 
 def set_variant_settings(variant_code: str, price: str, available: bool) -> None:
+    global _ENV_FILE_MTIME
     data = get_variant(variant_code)
-    sanitized = str(_price_to_int(price))
-    price_key = data["price_key"]
-    availability_key = data["availability_key"]
-    set_key(str(ENV_FILE), price_key, sanitized)
-    os.environ[price_key] = sanitized
-    set_key(str(ENV_FILE), availability_key, "1" if available else "0")
-    os.environ[availability_key] = "1" if available else "0"
-    _refresh_env(force=True)
+    updates = {
+        data.price_key: str(_price_to_int(price)),
+        data.availability_key: "1" if available else "0",
+    }
+    _write_env_values(updates)
+    os.environ.update(updates)
+    # the process already holds the new values, so skip re-parsing the file
+    _ENV_FILE_MTIME = ENV_FILE.stat().st_mtime
+    _get_variant_cached.cache_clear()
+    _admin_rows_cached.cache_clear()
 
 
 def list_admin_rows() -> list[dict[str, object]]:
-    rows: list[dict[str, object]] = []
-    for group_code, variant_codes in _ADMIN_ROWS:
-        title = _ADMIN_TITLES.get(group_code, group_code)
-        variants = [get_variant(code) for code in variant_codes]
-        rows.append({"code": group_code, "title": title, "variants": variants})
-    return rows
+    _refresh_env()
+    return [
+        {**row, "variants": list(row["variants"])}
+        for row in _admin_rows_cached(_ENV_FILE_MTIME)
+    ]
+
+
+@lru_cache(maxsize=4)
+def _admin_rows_cached(env_mtime: float | None) -> list[dict[str, object]]:
+    env_snap = {key: os.environ.get(key) for key in _ALL_KEYS}
+    return [
+        {
+            "code": group_code,
+            "title": title,
+            "variants": [_build_variant(code, env_snap) for code in variant_codes],
+        }
+        for group_code, title, variant_codes in _ADMIN_ROWS_RESOLVED
+    ]
 
 
 AI_VARIANT_MAP: dict[str, dict[str, str]] = {
@@ -265,6 +370,7 @@ TG_PREMIUM_VARIANTS: dict[str, str] = {
 __all__ = [
     "AI_VARIANT_MAP",
     "TG_PREMIUM_VARIANTS",
+    "VariantView",
     "get_variant",
     "get_variant_price_amount",
     "get_variant_price_text",
@@ -1,49 +1,64 @@
+from functools import lru_cache
+
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from .db import get_order
 from .config import CURRENCY
 
+_STATUS_FA_MAP = {
+    "AWAITING_PAYMENT": "در انتظار پرداخت",
+    "PENDING_CONFIRM": "در انتظار تایید پرداخت",
+    "PENDING_PLAN": "در انتظار تایید طرح",
+    "PLAN_CONFIRMED": "طرح تایید شد",
+    "APPROVED": "پرداخت تایید شد",
+    "IN_PROGRESS": "در حال انجام",
+    "READY_TO_DELIVER": "آماده تحویل",
+    "DELIVERED": "تحویل شد",
+    "COMPLETED": "تکمیل‌شده",
+    "EXPIRED": "منقضی",
+    "REJECTED": "رد شده",
+    "CANCELED": "لغو شده",
+}
+
+_AI_TITLES = {"team":"اکانت ChatGPT Team", "plus":"اکانت ChatGPT Plus", "google":"اکانت Google AI Pro"}
+
+_TG_PREMIUM_LABELS = {"3m":"۳ ماهه","6m":"۶ ماهه","12m":"۱۲ ماهه"}
+
 def _status_fa(code: str) -> str:
-    return {
-        "AWAITING_PAYMENT": "در انتظار پرداخت",
-        "PENDING_CONFIRM": "در انتظار تایید پرداخت",
-        "PENDING_PLAN": "در انتظار تایید طرح",
-        "PLAN_CONFIRMED": "طرح تایید شد",
-        "APPROVED": "پرداخت تایید شد",
-        "IN_PROGRESS": "در حال انجام",
-        "READY_TO_DELIVER": "آماده تحویل",
-        "DELIVERED": "تحویل شد",
-        "COMPLETED": "تکمیل‌شده",
-        "EXPIRED": "منقضی",
-        "REJECTED": "رد شده",
-        "CANCELED": "لغو شده",
-    }.get(code, code)
+    return _STATUS_FA_MAP.get(code, code)
 
 def _order_title(service_category: str, code: str, plan_title: str | None = None) -> str:
     if plan_title:
         return plan_title
     if service_category == "AI":
-        return {"team":"اکانت ChatGPT Team", "plus":"اکانت ChatGPT Plus", "google":"اکانت Google AI Pro"}.get(code, "سرویس هوش مصنوعی")
+        return _AI_TITLES.get(code, "سرویس هوش مصنوعی")
     if service_category == "TG":
         if code.startswith("premium_"):
             period = code.split("_")[1]
-            label = {"3m":"۳ ماهه","6m":"۶ ماهه","12m":"۱۲ ماهه"}.get(period, period)
+            label = _TG_PREMIUM_LABELS.get(period, period)
             return f"تلگرام پرمیوم ({label})"
         if code == "ready_pre": return "اکانت تلگرام آماده (از پیش ساخته‌شده)"
         if code == "ready_country": return "اکانت تلگرام آماده (کشور دلخواه)"
     return "سفارش"
 
+# (text, callback prefix) rows; only the order id differs between keyboards.
+_KB_TEMPLATE_NOPLAN = (
+    (("💳 پرداخت کارت", "cart:paycard:"), ("👛 کیف پول", "cart:paywallet:")),
+    (("🔀 پرداخت ترکیبی", "cart:paymix:"),),
+    (("❌ لغو سفارش", "cart:cancel:"),),
+)
+_KB_TEMPLATE_PLAN = (
+    (("💳 پرداخت کارت", "cart:paycard:"), ("👛 کیف پول", "cart:paywallet:")),
+    (("🔀 پرداخت ترکیبی", "cart:paymix:"), ("✨ طرح خرید اول", "cart:payplan:")),
+    (("❌ لغو سفارش", "cart:cancel:"),),
+)
+
+@lru_cache(maxsize=512)
 def _kb_checkout(oid: int, *, enable_plan: bool = False) -> InlineKeyboardMarkup:
+    template = _KB_TEMPLATE_PLAN if enable_plan else _KB_TEMPLATE_NOPLAN
     rows = [
-        [
-            InlineKeyboardButton(text="💳 پرداخت کارت", callback_data=f"cart:paycard:{oid}"),
-            InlineKeyboardButton(text="👛 کیف پول", callback_data=f"cart:paywallet:{oid}"),
-        ],
+        [InlineKeyboardButton(text=text, callback_data=f"{prefix}{oid}") for text, prefix in row]
+        for row in template
     ]
-    mix_row = [InlineKeyboardButton(text="🔀 پرداخت ترکیبی", callback_data=f"cart:paymix:{oid}")]
-    if enable_plan:
-        mix_row.append(InlineKeyboardButton(text="✨ طرح خرید اول", callback_data=f"cart:payplan:{oid}"))
-    rows.append(mix_row)
-    rows.append([InlineKeyboardButton(text="❌ لغو سفارش", callback_data=f"cart:cancel:{oid}")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 async def send_checkout_prompt(msg: Message, order_id: int):
@@ -1,5 +1,4 @@
 import os
-import os
 
 from dotenv import load_dotenv
 from aiogram.client.default import DefaultBotProperties
@@ -9,8 +8,13 @@ load_dotenv()
 
 # --- Telegram & App config ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
+ADMIN_IDS: frozenset[int] = frozenset(int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip())
 DB_PATH = os.getenv("DB_PATH", "data.db")
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+# bytes of the database file SQLite may memory-map; 0 turns mmap off (e.g. network filesystems)
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", "268435456"))
+# how long a connection waits on a locked database before raising "database is locked"
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
 
 BUSINESS_NAME = os.getenv("BUSINESS_NAME", "فروشگاه پرمیوم")
 CARD_NUMBER = os.getenv("CARD_NUMBER", "---- ---- ---- ----")
@@ -95,7 +99,8 @@ ADMIN_WEB_USER = os.getenv("ADMIN_WEB_USER", "admin")
 ADMIN_WEB_PASS = os.getenv("ADMIN_WEB_PASS", "admin")
 ADMIN_WEB_BIND = os.getenv("ADMIN_WEB_BIND", "127.0.0.1")
 ADMIN_WEB_PORT = int(os.getenv("ADMIN_WEB_PORT", "8080"))
-ADMIN_WEB_SECRET = os.getenv("ADMIN_WEB_SECRET", BOT_TOKEN[::-1] + "_secret")
+_token = BOT_TOKEN or ""
+ADMIN_WEB_SECRET = os.getenv("ADMIN_WEB_SECRET") or (_token[::-1] + "_secret")
 
 # --- Logging ---
 LOG_FILE = os.getenv("LOG_FILE", os.path.join(os.getcwd(), "logs", "bot.log"))
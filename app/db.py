@@ -1,21 +1,216 @@
+import atexit
+import queue
+import re
 import sqlite3
-from contextlib import closing
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, fields
 from datetime import datetime, timedelta
+from operator import attrgetter
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Callable, Iterable, Iterator
 import logging
 
-from .config import DB_PATH, ORDER_ID_MIN_VALUE, PAYMENT_TIMEOUT_MIN
+from .config import (
+    DB_BUSY_TIMEOUT_MS,
+    DB_MMAP_SIZE,
+    DB_PATH,
+    DB_READ_POOL_SIZE,
+    ORDER_ID_MIN_VALUE,
+    PAYMENT_TIMEOUT_MIN,
+)
 
-def _connect():
+def _connect(read_only: bool = False):
     db_path = Path(DB_PATH)
     parent = db_path.parent
     if parent and str(parent) not in {"", "."}:
         parent.mkdir(parents=True, exist_ok=True)
-    con = sqlite3.connect(str(db_path))
+    if read_only:
+        # readers can never take the write lock by accident; the file must already exist
+        target, uri = db_path.resolve().as_uri() + "?mode=ro", True
+    else:
+        target, uri = str(db_path), False
+    con = sqlite3.connect(target, uri=uri, check_same_thread=False, cached_statements=512)
     con.row_factory = sqlite3.Row
+    if not read_only:
+        con.execute("PRAGMA journal_mode=WAL;")
+    con.execute("PRAGMA synchronous=NORMAL;")
+    con.execute("PRAGMA temp_store=MEMORY;")
+    con.execute("PRAGMA cache_size=-64000;")
+    con.execute(f"PRAGMA mmap_size={max(DB_MMAP_SIZE, 0)};")
+    # set explicitly so readers and the writer wait the same configured time on a lock
+    con.execute(f"PRAGMA busy_timeout={max(DB_BUSY_TIMEOUT_MS, 0)};")
+    # per-connection and sticky, so once here covers every statement run on it
+    con.execute("PRAGMA foreign_keys=ON;")
     return con
 
+
+_PAGE_SIZE = 8192
+
+
+def _apply_page_size_if_fresh(con) -> None:
+    """Switch a brand-new database to larger pages.
+
+    page_size only takes effect before the first write (or after a VACUUM outside
+    WAL mode), so this is a no-op for databases that already hold a schema.
+    """
+
+    if con.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is not None:
+        return
+    if con.execute("PRAGMA page_size;").fetchone()[0] == _PAGE_SIZE:
+        return
+    try:
+        con.execute("PRAGMA journal_mode=DELETE;")
+        con.execute(f"PRAGMA page_size={_PAGE_SIZE};")
+        con.execute("VACUUM;")
+    except sqlite3.OperationalError:
+        # another connection holds the file open; keep the default page size
+        logging.warning("Could not change page size of fresh database", exc_info=True)
+    finally:
+        con.execute("PRAGMA journal_mode=WAL;")
+
+
+# A single writer connection plus a handful of readers: WAL lets the readers
+# run alongside the writer, while SQLite only ever allows one writer anyway.
+_POOL_LOCK = threading.Lock()
+_WRITER_POOL: "queue.Queue[sqlite3.Connection] | None" = None
+_READER_POOL: "queue.Queue[sqlite3.Connection] | None" = None
+
+
+def _get_pools() -> tuple["queue.Queue[sqlite3.Connection]", "queue.Queue[sqlite3.Connection]"]:
+    global _WRITER_POOL, _READER_POOL
+    if _WRITER_POOL is None or _READER_POOL is None:
+        with _POOL_LOCK:
+            if _WRITER_POOL is None or _READER_POOL is None:
+                # the writer goes first: it creates the file and switches it to WAL
+                writers: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=1)
+                writers.put(_connect())
+                size = max(int(DB_READ_POOL_SIZE or 1), 1)
+                readers: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=size)
+                for _ in range(size):
+                    readers.put(_connect(read_only=True))
+                _WRITER_POOL, _READER_POOL = writers, readers
+                atexit.register(_close_pools)
+    return _WRITER_POOL, _READER_POOL
+
+
+def _close_pools() -> None:
+    """Let SQLite refresh planner stats on the way out, then close every connection."""
+
+    global _WRITER_POOL, _READER_POOL
+    with _POOL_LOCK:
+        writers, readers = _WRITER_POOL, _READER_POOL
+        _WRITER_POOL = _READER_POOL = None
+    for pool, optimize in ((writers, True), (readers, False)):
+        while pool is not None and not pool.empty():
+            con = pool.get_nowait()
+            try:
+                if optimize:
+                    con.execute("PRAGMA optimize;")
+            except sqlite3.Error:
+                logging.exception("PRAGMA optimize failed")
+            finally:
+                con.close()
+
+
+@contextmanager
+def _pooled_connection(write: bool) -> Iterator[sqlite3.Connection]:
+    writers, readers = _get_pools()
+    pool = writers if write else readers
+    con = pool.get()
+    try:
+        yield con
+    except Exception:
+        if write:
+            con.rollback()
+        raise
+    finally:
+        pool.put(con)
+
+
+@contextmanager
+def _reader() -> Iterator[sqlite3.Connection]:
+    """Borrow a read-only connection; WAL lets several of these run beside the writer."""
+
+    with _pooled_connection(write=False) as con:
+        yield con
+
+
+def _now_iso() -> str:
+    """Local time as stored in every *_at column (ISO 8601, seconds precision)."""
+
+    # same text as datetime.now().isoformat(timespec="seconds"), without building a datetime
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+# Connection of the db_transaction() currently open on this thread, if any.
+_TX_STATE = threading.local()
+
+
+@contextmanager
+def db_transaction() -> Iterator[sqlite3.Connection]:
+    """Group db_execute calls made on this thread into one BEGIN IMMEDIATE ... COMMIT.
+
+    Nested use joins the outer transaction; reads inside it also go to the writer
+    so they see the uncommitted changes.
+    """
+
+    con = getattr(_TX_STATE, "con", None)
+    if con is not None:
+        yield con
+        return
+    with _pooled_connection(write=True) as con:
+        con.execute("BEGIN IMMEDIATE")
+        _TX_STATE.con = con
+        try:
+            yield con
+            con.commit()
+        finally:
+            _TX_STATE.con = None
+
+
+def _is_read_query(sql: str) -> bool:
+    return sql.lstrip()[:6].upper() == "SELECT"
+
+
+def _column_names(cursor: sqlite3.Cursor) -> tuple[str, ...]:
+    """Result column names, read once per statement rather than once per row."""
+
+    return tuple(c[0] for c in cursor.description)
+
+
+def _run(con, sql, params, do_commit, fetchone, fetchall, return_lastrowid, many=False, fetchval=False):
+    # rows come back as plain tuples and are zipped into the caller-facing dicts here
+    cur = con.cursor()
+    cur.row_factory = None
+    if many:
+        cur.executemany(sql, params)
+    else:
+        cur.execute(sql, params)
+    if return_lastrowid:
+        result = cur.lastrowid
+    elif fetchone:
+        row = cur.fetchone()
+        result = dict(zip(_column_names(cur), row)) if row is not None else None
+    elif fetchall:
+        rows = cur.fetchall()
+        if rows:
+            cols = _column_names(cur)
+            result = [dict(zip(cols, row)) for row in rows]
+        else:
+            result = []
+    elif fetchval:
+        r = cur.fetchone()
+        result = r[0] if r else None
+    else:
+        result = None
+    if do_commit:
+        con.commit()
+    return result
+
+
 def db_execute(
     sql,
     params=(),
@@ -24,22 +219,59 @@ def db_execute(
     fetchall=False,
     return_lastrowid=False,
     commit: bool | None = None,
+    many=False,
+    fetchval=False,
+    write: bool | None = None,
 ):
-    with closing(_connect()) as con:
-        cur = con.cursor()
-        cur.execute("PRAGMA foreign_keys=ON;")
-        cur.execute(sql, params)
+    """Run one statement on a pooled connection.
+
+    With ``many=True`` ``params`` is a sequence of parameter tuples handed to
+    ``executemany`` -- prefer it over a Python loop of single-row writes, which
+    pays a parse and a commit per row. ``fetchval=True`` returns the first column
+    of the first row (or None) without building a dict. Plain SELECTs go to the
+    read-only pool and everything else to the writer; pass ``write`` to override.
+    """
+
+    tx_con = getattr(_TX_STATE, "con", None)
+    if tx_con is not None:
+        # committed by the enclosing db_transaction()
+        return _run(tx_con, sql, params, False, fetchone, fetchall, return_lastrowid, many, fetchval)
+    if write is None:
+        write = many or not _is_read_query(sql)
+    if not write:
+        with _reader() as con:
+            return _run(con, sql, params, False, fetchone, fetchall, return_lastrowid, many, fetchval)
+    with _pooled_connection(write=True) as con:
         do_commit = True if commit is None else bool(commit)
-        if do_commit:
-            con.commit()
-        if return_lastrowid:
-            return cur.lastrowid
-        if fetchone:
-            r = cur.fetchone()
-            return dict(r) if r else None
-        if fetchall:
-            return [dict(x) for x in cur.fetchall()]
-    return None
+        return _run(con, sql, params, do_commit, fetchone, fetchall, return_lastrowid, many, fetchval)
+
+
+def _insert_returning_id(sql: str, params=()) -> int:
+    """Run one INSERT on the writer and return its rowid.
+
+    A fixed-shape shortcut for hot insert paths that skips db_execute's dispatch;
+    joins an open db_transaction() like db_execute does.
+    """
+
+    tx_con = getattr(_TX_STATE, "con", None)
+    if tx_con is not None:
+        return tx_con.execute(sql, params).lastrowid
+    with _pooled_connection(write=True) as con:
+        rowid = con.execute(sql, params).lastrowid
+        con.commit()
+    return rowid
+
+
+def _exec_write(sql: str, params=()) -> int:
+    """Run one write statement and return its rowcount (see _insert_returning_id)."""
+
+    tx_con = getattr(_TX_STATE, "con", None)
+    if tx_con is not None:
+        return tx_con.execute(sql, params).rowcount
+    with _pooled_connection(write=True) as con:
+        rowcount = con.execute(sql, params).rowcount
+        con.commit()
+    return rowcount
 
 
 def _ensure_order_sequence_min(min_order_id: int) -> None:
@@ -53,62 +285,64 @@ def _ensure_order_sequence_min(min_order_id: int) -> None:
         return
 
     target_seq = target - 1
-    with closing(_connect()) as con:
-        cur = con.cursor()
-        cur.execute("SELECT IFNULL(MAX(id), 0) FROM orders")
-        current_max = cur.fetchone()[0] or 0
+    # runs on the pooled writer rather than a throwaway connection of its own
+    with db_transaction():
+        current_max = db_execute("SELECT IFNULL(MAX(id), 0) FROM orders", fetchval=True) or 0
         if current_max >= target:
             return
         try:
-            cur.execute("SELECT seq FROM sqlite_sequence WHERE name='orders'")
-            row = cur.fetchone()
-            if row is None:
-                cur.execute(
+            seq = db_execute("SELECT seq FROM sqlite_sequence WHERE name='orders'", fetchval=True)
+            if seq is None:
+                db_execute(
                     "INSERT INTO sqlite_sequence(name, seq) VALUES(?, ?)",
                     ("orders", target_seq),
                 )
             else:
-                cur.execute(
+                db_execute(
                     "UPDATE sqlite_sequence SET seq=? WHERE name='orders'",
                     (target_seq,),
                 )
-            con.commit()
         except sqlite3.OperationalError:
             # sqlite_sequence may not exist yet (e.g., fresh database with no inserts)
             # In such case, inserting a dummy row and deleting it establishes the sequence.
-            cur.execute(
-                "INSERT INTO orders(id) VALUES(?)",
-                (target_seq,),
-            )
-            con.commit()
-            cur.execute("DELETE FROM orders WHERE id=?", (target_seq,))
-            con.commit()
+            db_execute("INSERT INTO orders(id) VALUES(?)", (target_seq,))
+            db_execute("DELETE FROM orders WHERE id=?", (target_seq,))
+
+
+# The sequence only grows, so once the configured floor is in place it stays there.
+_ORDER_FLOOR_APPLIED = False
 
 
 def ensure_order_id_floor(min_order_id: int | None = None) -> None:
     """Public helper to enforce the minimum order identifier."""
 
+    global _ORDER_FLOOR_APPLIED
     if min_order_id is None:
-        min_order_id = ORDER_ID_MIN_VALUE
+        if _ORDER_FLOOR_APPLIED:
+            return
+        _ensure_order_sequence_min(ORDER_ID_MIN_VALUE)
+        _ORDER_FLOOR_APPLIED = True
+        return
     _ensure_order_sequence_min(min_order_id)
             
-def _table_exists(con, name):
-    cur = con.cursor()
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (name,))
-    return cur.fetchone() is not None
-
-def _col_exists(con, table, col):
-    cur = con.cursor()
-    cur.execute(f"PRAGMA table_info({table})")
-    cols = [r[1] for r in cur.fetchall()]
-    return col in cols
-
-
 def _get_table_columns(cur, table: str) -> list[str]:
     cur.execute(f"PRAGMA table_info({table})")
     return [r[1] for r in cur.fetchall()]
 
 
+def _schema_snapshot(cur) -> dict[str, set[str]]:
+    """Map every table to its column names with a single query over the schema."""
+
+    schema: dict[str, set[str]] = {}
+    cur.execute(
+        "SELECT m.name, c.name FROM sqlite_master AS m, pragma_table_info(m.name) AS c "
+        "WHERE m.type='table'"
+    )
+    for table, column in cur.fetchall():
+        schema.setdefault(table, set()).add(column)
+    return schema
+
+
 def _create_orders_table(cur) -> None:
     cur.execute(
         """
@@ -123,8 +357,11 @@ def _create_orders_table(cur) -> None:
     )
 
 
-def _add_missing_columns(con, cur) -> None:
-    add_cols = [
+# Columns added after a table first shipped, grouped by schema version. Applied
+# versions are recorded in schema_migrations; to change the schema, append a new
+# version here and never edit one that has already shipped.
+_COLUMN_MIGRATIONS: tuple[tuple[int, tuple[tuple[str, str, str], ...]], ...] = (
+    (1, (
         ("orders", "service_category", "TEXT"),
         ("orders", "service_code", "TEXT"),
         ("orders", "account_mode", "TEXT"),
@@ -178,19 +415,174 @@ def _add_missing_columns(con, cur) -> None:
         ("coupons", "is_active", "INTEGER DEFAULT 1"),
         ("coupons", "usage_limit_per_user", "INTEGER DEFAULT 1"),
         ("coupon_redemptions", "times_used", "INTEGER DEFAULT 1"),
-    ]
-    for t, c, typ in add_cols:
-        if _table_exists(con, t) and not _col_exists(con, t, c):
-            cur.execute(f"ALTER TABLE {t} ADD COLUMN {c} {typ};")
+    )),
+    (2, (
+        ("discount_redemptions", "order_id", "INTEGER"),
+    )),
+    # used to be added lazily by set_user_phone_verified
+    (3, (
+        ("users", "phone", "TEXT"),
+        ("users", "phone_verified", "INTEGER DEFAULT 0"),
+    )),
+)
+
+
+def _add_missing_columns(con, cur, since_version: int = 0) -> None:
+    schema = _schema_snapshot(cur)
+    for version, columns in _COLUMN_MIGRATIONS:
+        if version <= since_version:
+            continue
+        for t, c, typ in columns:
+            if t in schema and c not in schema[t]:
+                cur.execute(f"ALTER TABLE {t} ADD COLUMN {c} {typ};")
+                schema[t].add(c)
+
+
+def _apply_column_migrations(con, cur) -> None:
+    """Run only the column migrations this database has not recorded yet."""
+
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations(version INTEGER PRIMARY KEY, applied_at TEXT);"
+    )
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    current = cur.fetchone()[0]
+    if current >= _COLUMN_MIGRATIONS[-1][0]:
+        return
+    _add_missing_columns(con, cur, since_version=current)
+    now = _now_iso()
+    cur.executemany(
+        "INSERT INTO schema_migrations(version, applied_at) VALUES(?, ?)",
+        [(version, now) for version, _ in _COLUMN_MIGRATIONS if version > current],
+    )
+
+
+# Admin text search runs against trigram FTS5 mirrors of these columns; trigram keeps the
+# old case-insensitive substring semantics of LIKE '%term%' for terms of 3+ characters.
+_SEARCH_INDEXES = {
+    "orders_fts": ("orders", "id", ("username", "first_name", "plan_title", "customer_email")),
+    "users_fts": ("users", "user_id", ("username", "first_name")),
+}
+
+
+def _ensure_search_indexes(cur) -> None:
+    """Create the external-content FTS tables and the triggers that keep them in sync."""
+
+    for fts, (table, key, cols) in _SEARCH_INDEXES.items():
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (fts,))
+        fresh = cur.fetchone() is None
+        col_sql = ", ".join(cols)
+        new_sql = ", ".join(f"new.{c}" for c in cols)
+        old_sql = ", ".join(f"old.{c}" for c in cols)
+        changed = " OR ".join(f"old.{c} IS NOT new.{c}" for c in cols)
+        cur.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{col_sql}, content='{table}', content_rowid='{key}', tokenize='trigram');"
+        )
+        cur.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {col_sql}) VALUES(new.{key}, {new_sql}); END;"
+        )
+        cur.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {col_sql}) VALUES('delete', old.{key}, {old_sql}); END;"
+        )
+        # status/wallet updates never touch the indexed columns, so they skip the trigger
+        cur.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {col_sql} ON {table} "
+            f"WHEN {changed} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {col_sql}) VALUES('delete', old.{key}, {old_sql}); "
+            f"INSERT INTO {fts}(rowid, {col_sql}) VALUES(new.{key}, {new_sql}); END;"
+        )
+        if fresh:
+            cur.execute(f"INSERT INTO {fts}({fts}) VALUES('rebuild');")
+
+
+def _ensure_dashboard_summaries(cur) -> None:
+    """Running per-status order and per-type wallet totals, kept current by triggers.
+
+    NULL statuses/types are folded into the '' key so the UPSERTs below always conflict.
+    """
+
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='orders_summary'")
+    fresh_orders = cur.fetchone() is None
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS orders_summary("
+        "status TEXT PRIMARY KEY NOT NULL, cnt INTEGER NOT NULL DEFAULT 0, revenue INTEGER NOT NULL DEFAULT 0);"
+    )
+    add_new = (
+        "INSERT INTO orders_summary(status, cnt, revenue) "
+        "VALUES(COALESCE(NEW.status, ''), 1, COALESCE(NEW.amount_total, 0)) "
+        "ON CONFLICT(status) DO UPDATE SET cnt=cnt+1, revenue=revenue+excluded.revenue;"
+    )
+    drop_old = (
+        "UPDATE orders_summary SET cnt=cnt-1, revenue=revenue-COALESCE(OLD.amount_total, 0) "
+        "WHERE status=COALESCE(OLD.status, '');"
+    )
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_orders_summary_ins AFTER INSERT ON orders BEGIN {add_new} END;")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_orders_summary_del AFTER DELETE ON orders BEGIN {drop_old} END;")
+    cur.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_orders_summary_upd AFTER UPDATE OF status, amount_total ON orders "
+        "WHEN OLD.status IS NOT NEW.status OR OLD.amount_total IS NOT NEW.amount_total "
+        f"BEGIN {drop_old} {add_new} END;"
+    )
+    if fresh_orders:
+        cur.execute(
+            "INSERT INTO orders_summary(status, cnt, revenue) "
+            "SELECT COALESCE(status, ''), COUNT(*), COALESCE(SUM(amount_total), 0) FROM orders "
+            "GROUP BY COALESCE(status, '');"
+        )
+
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='wallet_summary'")
+    fresh_wallet = cur.fetchone() is None
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS wallet_summary("
+        "type TEXT PRIMARY KEY NOT NULL, total INTEGER NOT NULL DEFAULT 0);"
+    )
+    add_new = (
+        "INSERT INTO wallet_summary(type, total) VALUES(COALESCE(NEW.type, ''), COALESCE(NEW.amount, 0)) "
+        "ON CONFLICT(type) DO UPDATE SET total=total+excluded.total;"
+    )
+    drop_old = "UPDATE wallet_summary SET total=total-COALESCE(OLD.amount, 0) WHERE type=COALESCE(OLD.type, '');"
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_wallet_summary_ins AFTER INSERT ON wallet_tx BEGIN {add_new} END;")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_wallet_summary_del AFTER DELETE ON wallet_tx BEGIN {drop_old} END;")
+    cur.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_wallet_summary_upd AFTER UPDATE OF type, amount ON wallet_tx "
+        "WHEN OLD.type IS NOT NEW.type OR OLD.amount IS NOT NEW.amount "
+        f"BEGIN {drop_old} {add_new} END;"
+    )
+    if fresh_wallet:
+        cur.execute(
+            "INSERT INTO wallet_summary(type, total) "
+            "SELECT COALESCE(type, ''), COALESCE(SUM(amount), 0) FROM wallet_tx GROUP BY COALESCE(type, '');"
+        )
+
+
+def _ensure_redemption_counters(cur) -> None:
+    """Keep coupons/discounts.used_count in step with their redemption rows."""
+
+    for parent, child, key in (
+        ("coupons", "coupon_redemptions", "coupon_id"),
+        ("discounts", "discount_redemptions", "discount_id"),
+    ):
+        cur.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_{child}_ins AFTER INSERT ON {child} BEGIN "
+            f"UPDATE {parent} SET used_count=COALESCE(used_count, 0)+COALESCE(NEW.times_used, 1), "
+            f"updated_at=NEW.redeemed_at WHERE id=NEW.{key}; END;"
+        )
+        cur.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_{child}_upd AFTER UPDATE OF times_used ON {child} "
+            f"WHEN NEW.times_used>COALESCE(OLD.times_used, 0) BEGIN "
+            f"UPDATE {parent} SET used_count=COALESCE(used_count, 0)+(NEW.times_used-COALESCE(OLD.times_used, 0)), "
+            f"updated_at=NEW.redeemed_at WHERE id=NEW.{key}; END;"
+        )
 
 
 def _ensure_orders_have_id(con, cur) -> None:
     """Migrate legacy ``orders`` tables that lack the ``id`` column."""
 
-    if not _table_exists(con, "orders"):
-        return
+    # table_info yields no rows for a missing table, so this single probe covers both checks
     cols = _get_table_columns(cur, "orders")
-    if "id" in cols:
+    if not cols or "id" in cols:
         return
 
     logging.info("Migrating orders table to add id column")
@@ -222,11 +614,13 @@ def _ensure_orders_have_id(con, cur) -> None:
         )
 
     cur.execute("DROP TABLE orders_old;")
-    con.commit()
 
 def init_db():
     with closing(_connect()) as con:
+        _apply_page_size_if_fresh(con)
         cur = con.cursor()
+        # one transaction for the whole migration instead of a commit per DDL statement
+        cur.execute("BEGIN")
         # users
         cur.execute("""
         CREATE TABLE IF NOT EXISTS users(
@@ -266,8 +660,18 @@ def init_db():
             );
             """
         )
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_products_parent ON products(parent_id);")
+        # children of a node in display order; also covers the parent_id lookups of
+        # delete_product and the FK cascade, so the plain parent_id index is redundant
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_products_parent_sort ON products(parent_id, sort_order);"
+        )
+        cur.execute("DROP INDEX IF EXISTS idx_products_parent;")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_products_sort ON products(sort_order);")
+        # has_sort_conflict compares parent ids NULL-safely through COALESCE(parent_id, -1)
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_products_parent_cat_sort "
+            "ON products(COALESCE(parent_id, -1), is_category, sort_order);"
+        )
         # service messages (requests sent from bot)
         cur.execute(
             """
@@ -289,10 +693,9 @@ def init_db():
             "CREATE INDEX IF NOT EXISTS idx_service_messages_category ON service_messages(category);"
         )
 
-        _add_missing_columns(con, cur)
-
-        # ensure schema changes are persisted before closing the connection
-        con.commit()
+        # tables created further down already carry every migrated column in
+        # their CREATE statement, so running this before them is safe
+        _apply_column_migrations(con, cur)
 
         # wallet transactions
         cur.execute("""
@@ -308,8 +711,31 @@ def init_db():
         """)
         # ایندکس‌های مفید
         cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id);")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_wallet_user ON wallet_tx(user_id);")
+        # the cart queries filter on all three columns
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_orders_user_status_deadline ON orders(user_id, status, await_deadline);"
+        )
+        # only unpaid orders are ever scanned by deadline (expire_orders_and_refund)
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_orders_status_deadline ON orders(status, await_deadline) "
+            "WHERE status='AWAITING_PAYMENT';"
+        )
+        # (status, id DESC) serves both status filters and "latest N by status" without a sort
+        cur.execute("DROP INDEX IF EXISTS idx_orders_status;")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_id ON orders(status, id DESC);")
+        # admin lists page through these newest-first; SQLite walks the indexes backwards
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at);")
+        # (user_id, created_at) also answers plain user_id lookups, so it replaces idx_wallet_user
+        cur.execute("DROP INDEX IF EXISTS idx_wallet_user;")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_wallet_tx_user_created ON wallet_tx(user_id, created_at);")
+        # an order's wallet history is listed newest-first
+        cur.execute("DROP INDEX IF EXISTS idx_wallet_tx_order;")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_wallet_tx_order_created ON wallet_tx(order_id, created_at);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_wallet_tx_created ON wallet_tx(created_at);")
+        _ensure_search_indexes(cur)
+        _ensure_dashboard_summaries(cur)
 
         # order manager message history
         cur.execute(
@@ -323,8 +749,11 @@ def init_db():
             );
             """
         )
+        # (order_id, created_at) returns an order's thread already newest-first
+        cur.execute("DROP INDEX IF EXISTS idx_order_manager_messages_order;")
         cur.execute(
-            "CREATE INDEX IF NOT EXISTS idx_order_manager_messages_order ON order_manager_messages(order_id);"
+            "CREATE INDEX IF NOT EXISTS idx_order_manager_messages_order_created "
+            "ON order_manager_messages(order_id, created_at);"
         )
 
         # service message replies
@@ -354,8 +783,10 @@ def init_db():
             );
             """
         )
+        cur.execute("DROP INDEX IF EXISTS idx_user_manager_messages_user;")
         cur.execute(
-            "CREATE INDEX IF NOT EXISTS idx_user_manager_messages_user ON user_manager_messages(user_id);"
+            "CREATE INDEX IF NOT EXISTS idx_user_manager_messages_user_created "
+            "ON user_manager_messages(user_id, created_at);"
         )
 
         # coupons
@@ -422,6 +853,7 @@ def init_db():
                 discount_id INTEGER NOT NULL,
                 user_id INTEGER NOT NULL,
                 amount INTEGER NOT NULL,
+                order_id INTEGER,
                 times_used INTEGER DEFAULT 1,
                 redeemed_at TEXT,
                 UNIQUE(discount_id, user_id),
@@ -435,21 +867,39 @@ def init_db():
         cur.execute(
             "CREATE INDEX IF NOT EXISTS idx_discount_redemptions_user ON discount_redemptions(user_id);"
         )
+        _ensure_redemption_counters(cur)
+
+        # ensure schema changes are persisted before closing the connection
+        con.commit()
+
+        # give the planner statistics once; afterwards PRAGMA optimize keeps them fresh
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='sqlite_stat1'")
+        if cur.fetchone() is None:
+            cur.execute("ANALYZE;")
+        else:
+            cur.execute("PRAGMA optimize;")
+
+    ensure_order_id_floor()
+
+
+def optimize_db() -> None:
+    """Refresh planner statistics where SQLite thinks they are stale (cheap when not)."""
+
+    db_execute("PRAGMA optimize;")
 
 
 def ensure_user(user_id: int, username: str, first_name: str):
-    now = datetime.now().isoformat(timespec="seconds")
-    row = db_execute("SELECT user_id FROM users WHERE user_id=?", (user_id,), fetchone=True)
-    if not row:
-        db_execute(
-            "INSERT INTO users(user_id, username, first_name, created_at, updated_at) VALUES(?,?,?,?,?)",
-            (user_id, username, first_name or "", now, now),
-        )
-    else:
-        db_execute(
-            "UPDATE users SET username=?, first_name=?, updated_at=? WHERE user_id=?",
-            (username, first_name or "", now, user_id),
-        )
+    now = _now_iso()
+    db_execute(
+        """
+        INSERT INTO users(user_id, username, first_name, created_at, updated_at) VALUES(?,?,?,?,?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            username=excluded.username,
+            first_name=excluded.first_name,
+            updated_at=excluded.updated_at
+        """,
+        (user_id, username, first_name or "", now, now),
+    )
 
 
 def get_user(user_id: int):
@@ -457,34 +907,46 @@ def get_user(user_id: int):
 
 
 def is_user_contact_verified(user_id: int) -> bool:
-    user = get_user(user_id)
-    if not user:
-        return False
-    return bool(int(user.get("contact_verified") or 0))
+    verified = db_execute(
+        "SELECT COALESCE(contact_verified, 0) != 0 FROM users WHERE user_id=?",
+        (user_id,),
+        fetchval=True,
+    )
+    return bool(verified)
 
 
 def set_user_contact_verified(user_id: int, phone_number: str) -> None:
-    now = datetime.now().isoformat(timespec="seconds")
+    now = _now_iso()
     db_execute(
         "UPDATE users SET contact_phone=?, contact_verified=1, contact_shared_at=?, updated_at=? WHERE user_id=?",
         (phone_number or "", now, now, user_id),
     )
 
-def change_wallet(user_id: int, delta: int, tx_type: str, note: str = "", order_id: int | None = None):
+def change_wallet(
+    user_id: int, delta: int, tx_type: str, note: str = "", order_id: int | None = None
+) -> tuple[bool, int | None]:
     # delta: مثبت => افزایش موجودی، منفی => کسر
-    u = get_user(user_id)
-    if not u:
-        return False
-    new_bal = int(u["wallet_balance"]) + int(delta)
-    if new_bal < 0:
-        return False
-    now = datetime.now().isoformat(timespec="seconds")
-    db_execute("UPDATE users SET wallet_balance=?, updated_at=? WHERE user_id=?", (new_bal, now, user_id))
-    db_execute(
-        "INSERT INTO wallet_tx(user_id, order_id, amount, type, note, created_at) VALUES(?,?,?,?,?,?)",
-        (user_id, order_id, abs(delta), tx_type, note, now)
-    )
-    return True
+    # returns (success, balance after the change); the balance is None when nothing changed
+    delta = int(delta)
+    now = _now_iso()
+    with db_transaction():
+        # the balance check and the write are one statement, so concurrent debits cannot overdraw
+        updated = db_execute(
+            """
+            UPDATE users SET wallet_balance=COALESCE(wallet_balance, 0)+?, updated_at=?
+            WHERE user_id=? AND COALESCE(wallet_balance, 0)+?>=0
+            RETURNING wallet_balance
+            """,
+            (delta, now, user_id, delta),
+            fetchone=True,
+        )
+        if updated is None:
+            return False, None
+        db_execute(
+            "INSERT INTO wallet_tx(user_id, order_id, amount, type, note, created_at) VALUES(?,?,?,?,?,?)",
+            (user_id, order_id, abs(delta), tx_type, note, now)
+        )
+    return True, int(updated["wallet_balance"])
 
 
 def refresh_order_deadline(order_id: int, minutes: int | None = None) -> str:
@@ -528,6 +990,9 @@ def create_order(
     if amount_total <= 0 and not allow_free:
         return None
     now = datetime.now()
+    now_iso = now.isoformat(timespec="seconds")
+    # تنظیم ددلاین ۱۵ دقیقه
+    await_deadline = (now + timedelta(minutes=PAYMENT_TIMEOUT_MIN)).isoformat(timespec="seconds")
     ensure_order_id_floor()
     oid = db_execute("""
         INSERT INTO orders(
@@ -540,12 +1005,13 @@ def create_order(
             require_username, require_password,
             customer_username, customer_password,
             allow_first_plan, cashback_percent,
-            discount_id, discount_code, discount_amount
-        ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+            discount_id, discount_code, discount_amount,
+            await_deadline
+        ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
     """, (
         user["user_id"], user["username"], user["first_name"] or "",
         None, title, str(amount_total),
-        "AWAITING_PAYMENT", now.isoformat(timespec="seconds"), now.isoformat(timespec="seconds"),
+        "AWAITING_PAYMENT", now_iso, now_iso,
         amount_total, currency, service_category, service_code,
         account_mode or "", customer_email or "", notes or "",
         customer_secret or "",
@@ -558,58 +1024,78 @@ def create_order(
         None,
         "",
         0,
+        await_deadline,
     ), return_lastrowid=True)
-    # تنظیم ددلاین ۱۵ دقیقه
-    await_deadline = (now + timedelta(minutes=PAYMENT_TIMEOUT_MIN)).isoformat(timespec="seconds")
-    db_execute("UPDATE orders SET await_deadline=? WHERE id=?", (await_deadline, oid))
     return oid
 
+_PAID_STATUSES = frozenset({"IN_PROGRESS", "READY_TO_DELIVER", "DELIVERED", "COMPLETED"})
+
+# status groups of the user-facing order history; the IN fragments are built once so
+# every call sends SQLite the same statement text (a statement-cache hit)
+_INPROG_STATUSES = ("PENDING_CONFIRM", "PENDING_PLAN", "APPROVED", "IN_PROGRESS", "READY_TO_DELIVER")
+_DONE_STATUSES = ("DELIVERED", "COMPLETED")
+_INPROG_IN = "status IN (" + ",".join("?" * len(_INPROG_STATUSES)) + ")"
+_DONE_IN = "status IN (" + ",".join("?" * len(_DONE_STATUSES)) + ")"
+# the only order columns the cashback computation reads
+_CASHBACK_COLUMNS = "user_id, amount_total, price, cashback_percent, cashback_applied_amount"
+
+
 def set_order_status(order_id: int, status: str):
-    previous = get_order(order_id)
-    db_execute(
-        "UPDATE orders SET status=?, updated_at=? WHERE id=?",
-        (status, datetime.now().isoformat(timespec="seconds"), order_id),
-    )
-    updated = get_order(order_id)
-    paid_statuses = {"IN_PROGRESS", "READY_TO_DELIVER", "DELIVERED", "COMPLETED"}
-    if (
-        updated
-        and previous
-        and previous.get("status") != updated.get("status")
-        and updated.get("status") in paid_statuses
-    ):
-        apply_order_cashback(order_id)
+    now = _now_iso()
+    with db_transaction():
+        # only matches when the status actually changes, which is when cashback may apply
+        changed = db_execute(
+            f"""
+            UPDATE orders SET status=?, updated_at=? WHERE id=? AND status IS NOT ?
+            RETURNING {_CASHBACK_COLUMNS}
+            """,
+            (status, now, order_id, status),
+            fetchone=True,
+        )
+        if changed is None:
+            db_execute("UPDATE orders SET updated_at=? WHERE id=?", (now, order_id))
+        elif status in _PAID_STATUSES:
+            _apply_cashback(order_id, changed)
 
 def set_order_receipt(order_id: int, file_id: str | None, text: str | None):
     db_execute("UPDATE orders SET receipt_file_id=?, receipt_text=?, updated_at=? WHERE id=?",
-               (file_id, text, datetime.now().isoformat(timespec="seconds"), order_id))
+               (file_id, text, _now_iso(), order_id))
 
 def set_order_payment_type(order_id: int, ptype: str):
-    db_execute("UPDATE orders SET payment_type=?, updated_at=? WHERE id=?", (ptype, datetime.now().isoformat(timespec="seconds"), order_id))
+    db_execute("UPDATE orders SET payment_type=?, updated_at=? WHERE id=?", (ptype, _now_iso(), order_id))
 
 def set_order_wallet_reserved(order_id: int, amount: int):
-    db_execute("UPDATE orders SET wallet_reserved_amount=?, updated_at=? WHERE id=?", (amount, datetime.now().isoformat(timespec="seconds"), order_id))
+    db_execute("UPDATE orders SET wallet_reserved_amount=?, updated_at=? WHERE id=?", (amount, _now_iso(), order_id))
 
 def set_order_wallet_used(order_id: int, amount: int):
-    db_execute("UPDATE orders SET wallet_used_amount=?, updated_at=? WHERE id=?", (amount, datetime.now().isoformat(timespec="seconds"), order_id))
+    db_execute("UPDATE orders SET wallet_used_amount=?, updated_at=? WHERE id=?", (amount, _now_iso(), order_id))
 
 def set_order_customer_message(order_id: int, message: str | None):
     db_execute(
         "UPDATE orders SET customer_message=?, updated_at=? WHERE id=?",
-        (message or "", datetime.now().isoformat(timespec="seconds"), order_id),
+        (message or "", _now_iso(), order_id),
     )
 
 def set_order_manager_note(order_id: int, note: str | None):
     db_execute(
         "UPDATE orders SET manager_note=?, updated_at=? WHERE id=?",
-        (note or "", datetime.now().isoformat(timespec="seconds"), order_id),
+        (note or "", _now_iso(), order_id),
     )
 
 
 def apply_order_cashback(order_id: int) -> int:
-    order = get_order(order_id)
-    if not order:
-        return 0
+    with db_transaction():
+        order = db_execute(
+            f"SELECT {_CASHBACK_COLUMNS} FROM orders WHERE id=?", (order_id,), fetchone=True
+        )
+        if not order:
+            return 0
+        return _apply_cashback(order_id, order)
+
+
+def _apply_cashback(order_id: int, order: dict[str, Any]) -> int:
+    """Credit the not-yet-applied cashback of ``order``; call inside db_transaction()."""
+
     try:
         percent = max(int(order.get("cashback_percent") or 0), 0)
     except (TypeError, ValueError):
@@ -622,20 +1108,20 @@ def apply_order_cashback(order_id: int) -> int:
     remaining = max(cashback_total - already_applied, 0)
     if remaining <= 0 or not order.get("user_id"):
         return 0
-    success = change_wallet(
+    success, _ = change_wallet(
         order["user_id"], remaining, "CREDIT", note=f"CASHBACK:ORDER:{order_id}", order_id=order_id
     )
     if not success:
         return 0
     db_execute(
         "UPDATE orders SET cashback_applied_amount=?, updated_at=? WHERE id=?",
-        (cashback_total, datetime.now().isoformat(timespec="seconds"), order_id),
+        (cashback_total, _now_iso(), order_id),
     )
     return remaining
 
 
 def add_order_manager_message(order_id: int, user_id: int | None, message: str) -> int:
-    now = datetime.now().isoformat(timespec="seconds")
+    now = _now_iso()
     return db_execute(
         """
         INSERT INTO order_manager_messages(order_id, user_id, message_text, created_at)
@@ -660,7 +1146,7 @@ def list_order_manager_messages(order_id: int, limit: int = 50) -> list[dict[str
 
 
 def add_user_manager_message(user_id: int, message_text: str) -> int:
-    now = datetime.now().isoformat(timespec="seconds")
+    now = _now_iso()
     return db_execute(
         """
         INSERT INTO user_manager_messages(user_id, message_text, created_at)
@@ -685,24 +1171,26 @@ def list_user_manager_messages(user_id: int, limit: int = 50) -> list[dict[str,
 
 
 def set_order_financials(order_id: int, cost_amount: int) -> None:
-    order = get_order(order_id)
-    if not order:
-        return
     try:
         cost = max(int(cost_amount or 0), 0)
     except (TypeError, ValueError):
         cost = 0
-    total = int(order.get("amount_total") or order.get("price") or 0)
-    net = max(total - cost, 0)
+    # net revenue is derived from the stored total in the same statement
     db_execute(
-        "UPDATE orders SET internal_cost=?, net_revenue=?, updated_at=? WHERE id=?",
-        (cost, net, datetime.now().isoformat(timespec="seconds"), order_id),
+        """
+        UPDATE orders SET
+            internal_cost=?,
+            net_revenue=MAX(COALESCE(NULLIF(amount_total, 0), CAST(NULLIF(price, '') AS INTEGER), 0) - ?, 0),
+            updated_at=?
+        WHERE id=?
+        """,
+        (cost, cost, _now_iso(), order_id),
     )
 
 def set_order_customer_secret(order_id: int, secret: str | None):
     db_execute(
         "UPDATE orders SET customer_secret_encrypted=?, updated_at=? WHERE id=?",
-        (secret or "", datetime.now().isoformat(timespec="seconds"), order_id),
+        (secret or "", _now_iso(), order_id),
     )
 
 def get_order(order_id: int):
@@ -723,74 +1211,61 @@ def get_order_payable_amount(order: dict | None) -> int:
     return max(base - discount, 0)
 
 def user_has_delivered_order(user_id: int) -> bool:
-    row = db_execute(
-        """
-        SELECT 1 FROM orders
-        WHERE user_id=? AND status IN ('DELIVERED','COMPLETED')
-        LIMIT 1
-        """,
-        (user_id,),
-        fetchone=True,
+    return bool(
+        db_execute(
+            f"SELECT EXISTS(SELECT 1 FROM orders WHERE user_id=? AND {_DONE_IN})",
+            (user_id, *_DONE_STATUSES),
+            fetchval=True,
+        )
     )
-    return bool(row)
 
 def _normalize_cart_orders(user_id: int, order_id: int | None = None):
     now = datetime.now()
     now_iso = now.isoformat(timespec="seconds")
+    fresh_deadline = (now + timedelta(minutes=PAYMENT_TIMEOUT_MIN)).isoformat(timespec="seconds")
 
-    filters = ["user_id=?", "status IN ('AWAITING_PAYMENT','PENDING_CONFIRM','', 'در انتظار پرداخت')"]
+    filters = ["user_id=?"]
     params: list[int | str] = [user_id]
     if order_id:
         filters.append("id=?")
         params.append(order_id)
+    where = " AND ".join(filters)
 
-    candidates = db_execute(
-        f"""
-        SELECT * FROM orders
-        WHERE {' AND '.join(filters)}
-        """,
-        tuple(params),
-        fetchall=True,
-    ) or []
-
-    valid_ids: list[int] = []
-    for o in candidates:
-        oid = int(o.get("id"))
-        status = (o.get("status") or "").strip()
-        if status in {"", "در انتظار پرداخت"}:
-            set_order_status(oid, "AWAITING_PAYMENT")
-            o["status"] = "AWAITING_PAYMENT"
-        elif status not in {"AWAITING_PAYMENT", "PENDING_CONFIRM"}:
-            continue
-
-        deadline_raw = (o.get("await_deadline") or "").strip()
-        if not deadline_raw:
-            deadline_raw = refresh_order_deadline(oid)
-            o["await_deadline"] = deadline_raw
-        try:
-            if deadline_raw and datetime.fromisoformat(deadline_raw) <= now:
-                set_order_status(oid, "EXPIRED")
-                continue
-        except ValueError:
-            deadline_raw = refresh_order_deadline(oid)
-            o["await_deadline"] = deadline_raw
-
-        valid_ids.append(oid)
-
-    if not valid_ids:
-        return []
-
-    placeholders = ",".join("?" for _ in valid_ids)
-    return db_execute(
-        f"""
-        SELECT * FROM orders
-        WHERE id IN ({placeholders})
-          AND (await_deadline IS NULL OR await_deadline='' OR await_deadline > ?)
-        ORDER BY await_deadline ASC
-        """,
-        (*valid_ids, now_iso),
-        fetchall=True,
-    )
+    # legacy statuses become AWAITING_PAYMENT, blank/unparseable deadlines are
+    # restarted and overdue orders are expired -- all in a single UPDATE
+    deadline = "datetime(TRIM(COALESCE(await_deadline, '')))"
+    with db_transaction():
+        db_execute(
+            f"""
+            UPDATE orders SET
+                status = CASE
+                    WHEN {deadline} IS NOT NULL AND {deadline} <= datetime(?) THEN 'EXPIRED'
+                    WHEN status IN ('', 'در انتظار پرداخت') THEN 'AWAITING_PAYMENT'
+                    ELSE status
+                END,
+                await_deadline = CASE WHEN {deadline} IS NULL THEN ? ELSE await_deadline END,
+                updated_at = ?
+            WHERE {where}
+              AND status IN ('AWAITING_PAYMENT', 'PENDING_CONFIRM', '', 'در انتظار پرداخت')
+              AND (
+                  status IN ('', 'در انتظار پرداخت')
+                  OR {deadline} IS NULL
+                  OR {deadline} <= datetime(?)
+              )
+            """,
+            (now_iso, fresh_deadline, now_iso, *params, now_iso),
+        )
+        return db_execute(
+            f"""
+            SELECT * FROM orders
+            WHERE {where}
+              AND status IN ('AWAITING_PAYMENT', 'PENDING_CONFIRM')
+              AND (await_deadline IS NULL OR await_deadline='' OR await_deadline > ?)
+            ORDER BY await_deadline ASC
+            """,
+            (*params, now_iso),
+            fetchall=True,
+        )
 
 
 def list_cart_orders(user_id: int):
@@ -803,35 +1278,134 @@ def get_cart_order(order_id: int, user_id: int):
 
 def expire_orders_and_refund():
     # سفارش‌های در انتظار پرداخت که ددلاین گذشته
-    expired = db_execute("""
-        SELECT * FROM orders
-        WHERE status='AWAITING_PAYMENT' AND await_deadline IS NOT NULL AND await_deadline <= ?
-    """, (datetime.now().isoformat(timespec="seconds"),), fetchall=True)
-    for o in expired:
-        rid = int(o["id"])
-        reserved = int(o.get("wallet_reserved_amount") or 0)
-        if reserved > 0:
-            # refund
-            change_wallet(o["user_id"], reserved, "REFUND", note=f"Expire order #{rid}", order_id=rid)
-            set_order_wallet_reserved(rid, 0)
-        set_order_status(rid, "EXPIRED")
-    return expired
+    now = _now_iso()
+    expired_filter = (
+        "status='AWAITING_PAYMENT' AND await_deadline IS NOT NULL AND await_deadline <= ?"
+    )
+    with db_transaction():
+        # refund every reserved amount in bulk, then expire the orders themselves
+        db_execute(
+            f"""
+            UPDATE users SET
+                wallet_balance = COALESCE(wallet_balance, 0) + (
+                    SELECT SUM(wallet_reserved_amount) FROM orders
+                    WHERE orders.user_id=users.user_id AND wallet_reserved_amount > 0 AND {expired_filter}
+                ),
+                updated_at = ?
+            WHERE user_id IN (
+                SELECT user_id FROM orders WHERE wallet_reserved_amount > 0 AND {expired_filter}
+            )
+            """,
+            (now, now, now),
+        )
+        db_execute(
+            f"""
+            INSERT INTO wallet_tx(user_id, order_id, amount, type, note, created_at)
+            SELECT user_id, id, wallet_reserved_amount, 'REFUND', 'Expire order #' || id, ?
+            FROM orders
+            WHERE wallet_reserved_amount > 0 AND {expired_filter}
+              AND user_id IN (SELECT user_id FROM users)
+            """,
+            (now, now),
+        )
+        return db_execute(
+            f"""
+            UPDATE orders SET status='EXPIRED', wallet_reserved_amount=0, updated_at=?
+            WHERE {expired_filter}
+            RETURNING *
+            """,
+            (now, now),
+            fetchall=True,
+        )
 
 
-def create_coupon(
-    code: str,
-    amount: int,
-    usage_limit: int,
-    expires_at: str | None = None,
-    *,
-    usage_limit_per_user: int | None = None,
-) -> int:
-    now = datetime.now().isoformat(timespec="seconds")
-    normalized = (code or "").strip().upper()
-    if not normalized:
-        raise ValueError("Coupon code cannot be empty")
+# Normalisation of empty expiries, per-user limits and flags happens in SQL; only the
+# 0/1 -> bool flip (and product id parsing for discounts) is left to Python.
+_COUPON_COLUMNS = """
+    id, code, amount, usage_limit,
+    COALESCE(NULLIF(usage_limit_per_user, 0), 1) AS usage_limit_per_user,
+    used_count, COALESCE(is_active, 0) != 0 AS is_active,
+    NULLIF(expires_at, '') AS expires_at, created_at, updated_at
+"""
+_DISCOUNT_COLUMNS = """
+    id, code, amount, usage_limit,
+    COALESCE(NULLIF(usage_limit_per_user, 0), 1) AS usage_limit_per_user,
+    used_count, COALESCE(is_active, 0) != 0 AS is_active,
+    COALESCE(applies_all, 0) != 0 AS applies_all, product_ids,
+    NULLIF(expires_at, '') AS expires_at, created_at, updated_at
+"""
+
+_SQL_LIST_COUPONS = f"SELECT {_COUPON_COLUMNS} FROM coupons ORDER BY created_at DESC LIMIT ? OFFSET ?"
+_SQL_GET_COUPON = f"SELECT {_COUPON_COLUMNS} FROM coupons WHERE id=?"
+_SQL_GET_COUPON_BY_CODE = f"SELECT {_COUPON_COLUMNS} FROM coupons WHERE code=?"
+_SQL_LIST_DISCOUNTS = f"SELECT {_DISCOUNT_COLUMNS} FROM discounts ORDER BY created_at DESC LIMIT ? OFFSET ?"
+_SQL_GET_DISCOUNT = f"SELECT {_DISCOUNT_COLUMNS} FROM discounts WHERE id=?"
+_SQL_GET_DISCOUNT_BY_CODE = f"SELECT {_DISCOUNT_COLUMNS} FROM discounts WHERE code=?"
+
+
+def _coupon_from_row(row: dict[str, Any]) -> dict[str, Any]:
+    row["is_active"] = bool(row["is_active"])
+    return row
+
+
+def _discount_from_row(row: dict[str, Any]) -> dict[str, Any]:
+    row["is_active"] = bool(row["is_active"])
+    row["applies_all"] = bool(row["applies_all"])
+    row["product_ids"] = _parse_product_ids(row["product_ids"])
+    return row
+
+
+# Short-lived cache of coupon/discount rows keyed by (table, code). Misses are cached
+# too, so a burst of attempts with one (possibly bogus) code costs a single SELECT.
+_CODE_CACHE_TTL = 30.0
+_CODE_CACHE_SIZE = 256
+_CODE_CACHE: "OrderedDict[tuple[str, str], tuple[float, dict[str, Any] | None]]" = OrderedDict()
+_CODE_CACHE_LOCK = threading.Lock()
+
+
+def _code_cache_get(table: str, code: str) -> tuple[bool, dict[str, Any] | None]:
+    key = (table, code)
+    with _CODE_CACHE_LOCK:
+        entry = _CODE_CACHE.get(key)
+        if entry is None:
+            return False, None
+        expires, row = entry
+        if expires < time.monotonic():
+            del _CODE_CACHE[key]
+            return False, None
+        _CODE_CACHE.move_to_end(key)
+    return True, dict(row) if row is not None else None
+
+
+def _code_cache_put(table: str, code: str, row: dict[str, Any] | None) -> None:
+    with _CODE_CACHE_LOCK:
+        _CODE_CACHE[(table, code)] = (time.monotonic() + _CODE_CACHE_TTL, dict(row) if row else None)
+        _CODE_CACHE.move_to_end((table, code))
+        while len(_CODE_CACHE) > _CODE_CACHE_SIZE:
+            _CODE_CACHE.popitem(last=False)
+
+
+def _code_cache_invalidate(table: str) -> None:
+    # updates may rename a code, so drop every entry of the table rather than one key
+    with _CODE_CACHE_LOCK:
+        for key in [key for key in _CODE_CACHE if key[0] == table]:
+            del _CODE_CACHE[key]
+
+
+def create_coupon(
+    code: str,
+    amount: int,
+    usage_limit: int,
+    expires_at: str | None = None,
+    *,
+    usage_limit_per_user: int | None = None,
+) -> int:
+    now = _now_iso()
+    normalized = (code or "").strip().upper()
+    if not normalized:
+        raise ValueError("Coupon code cannot be empty")
     per_user = 1 if usage_limit_per_user is None else int(usage_limit_per_user)
-    return db_execute(
+    coupon_id = db_execute(
         """
         INSERT INTO coupons(code, amount, usage_limit, usage_limit_per_user, used_count, expires_at, created_at, updated_at, is_active)
         VALUES(?,?,?,?,?,?,?,?,?)
@@ -839,6 +1413,8 @@ def create_coupon(
         (normalized, int(amount), int(usage_limit), per_user, 0, expires_at, now, now, 1),
         return_lastrowid=True,
     )
+    _code_cache_invalidate("coupons")
+    return coupon_id
 
 
 def update_coupon(
@@ -851,7 +1427,7 @@ def update_coupon(
     expires_at: str | None,
     is_active: bool | int | None = None,
 ) -> bool:
-    now = datetime.now().isoformat(timespec="seconds")
+    now = _now_iso()
     normalized = (code or "").strip().upper()
     if not normalized:
         return False
@@ -876,47 +1452,32 @@ def update_coupon(
         """,
         tuple(params),
     )
+    _code_cache_invalidate("coupons")
     return True
 
 
 def set_coupon_active(coupon_id: int, active: bool) -> None:
-    now = datetime.now().isoformat(timespec="seconds")
+    now = _now_iso()
     db_execute(
         "UPDATE coupons SET is_active=?, updated_at=? WHERE id=?",
         (1 if active else 0, now, coupon_id),
     )
+    _code_cache_invalidate("coupons")
 
 
 def delete_coupon(coupon_id: int) -> None:
     db_execute("DELETE FROM coupons WHERE id=?", (coupon_id,))
+    _code_cache_invalidate("coupons")
 
 
 def list_coupons(limit: int = 100, offset: int = 0) -> list[dict[str, Any]]:
-    rows = db_execute(
-        """
-        SELECT * FROM coupons
-        ORDER BY created_at DESC
-        LIMIT ? OFFSET ?
-        """,
-        (limit, offset),
-        fetchall=True,
-    ) or []
-    for row in rows:
-        if not row.get("expires_at"):
-            row["expires_at"] = None
-        row["usage_limit_per_user"] = int(row.get("usage_limit_per_user") or 1)
-        row["is_active"] = bool(int(row.get("is_active") or 0))
-    return rows
+    rows = db_execute(_SQL_LIST_COUPONS, (limit, offset), fetchall=True) or []
+    return [_coupon_from_row(row) for row in rows]
 
 
 def get_coupon(coupon_id: int):
-    row = db_execute("SELECT * FROM coupons WHERE id=?", (coupon_id,), fetchone=True)
-    if row:
-        if not row.get("expires_at"):
-            row["expires_at"] = None
-        row["usage_limit_per_user"] = int(row.get("usage_limit_per_user") or 1)
-        row["is_active"] = bool(int(row.get("is_active") or 0))
-    return row
+    row = db_execute(_SQL_GET_COUPON, (coupon_id,), fetchone=True)
+    return _coupon_from_row(row) if row else None
 
 
 def list_coupon_redemptions(coupon_id: int) -> list[dict[str, Any]]:
@@ -932,25 +1493,55 @@ def list_coupon_redemptions(coupon_id: int) -> list[dict[str, Any]]:
     ) or []
 
 
-def get_coupon_by_code(code: str):
+def get_coupon_by_code(code: str, *, fresh: bool = False):
+    """Coupon row for ``code``, served from a 30s cache unless ``fresh`` is set.
+
+    Cached rows may lag ``used_count`` by up to the TTL; limit checks must pass ``fresh=True``.
+    """
+
     normalized = (code or "").strip().upper()
     if not normalized:
         return None
-    row = db_execute("SELECT * FROM coupons WHERE UPPER(code)=?", (normalized,), fetchone=True)
+    if not fresh:
+        hit, cached = _code_cache_get("coupons", normalized)
+        if hit:
+            return cached
+    row = db_execute(_SQL_GET_COUPON_BY_CODE, (normalized,), fetchone=True)
     if row:
-        if not row.get("expires_at"):
-            row["expires_at"] = None
-        row["usage_limit_per_user"] = int(row.get("usage_limit_per_user") or 1)
-        row["is_active"] = bool(int(row.get("is_active") or 0))
+        _coupon_from_row(row)
+    _code_cache_put("coupons", normalized, row)
     return row
 
 
+class _RedemptionAborted(Exception):
+    """Raised inside a redemption transaction to roll back its writes."""
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
 def redeem_coupon(user_id: int, code: str) -> tuple[bool, dict[str, Any] | None, str | None]:
     normalized = (code or "").strip().upper()
     if not normalized:
         return False, None, "کد کوپن نامعتبر است."
 
-    coupon = get_coupon_by_code(normalized)
+    # unknown or disabled codes are rejected from the cache without taking the write lock
+    cached = get_coupon_by_code(normalized)
+    if not cached:
+        return False, None, "چنین کدی وجود ندارد."
+    if not cached.get("is_active"):
+        return False, None, "این کوپن غیرفعال است."
+
+    try:
+        with db_transaction():
+            return _redeem_coupon_locked(user_id, normalized)
+    except _RedemptionAborted as exc:
+        return False, None, exc.message
+
+
+def _redeem_coupon_locked(user_id: int, normalized: str) -> tuple[bool, dict[str, Any] | None, str | None]:
+    coupon = get_coupon_by_code(normalized, fresh=True)
     if not coupon:
         return False, None, "چنین کدی وجود ندارد."
 
@@ -969,66 +1560,52 @@ def redeem_coupon(user_id: int, code: str) -> tuple[bool, dict[str, Any] | None,
     if limit and used >= limit:
         return False, None, "ظرفیت استفاده از این کوپن تکمیل شده است."
 
+    # one clock read serves both the expiry check and the timestamps written below
+    current = datetime.now()
     expires_at = coupon.get("expires_at")
     if expires_at:
         try:
             expire_dt = datetime.fromisoformat(str(expires_at))
-            if datetime.now() > expire_dt:
+            if current > expire_dt:
                 return False, None, "تاریخ انقضای این کوپن گذشته است."
         except ValueError:
             pass
 
+    now = current.isoformat(timespec="seconds")
+    per_user_limit = int(coupon.get("usage_limit_per_user") or 1)
+    # insert-or-bump in one statement; the DO UPDATE guard leaves no row when the
+    # per-user limit is already reached
     redemption = db_execute(
-        "SELECT id, times_used FROM coupon_redemptions WHERE coupon_id=? AND user_id=?",
-        (coupon["id"], user_id),
+        """
+        INSERT INTO coupon_redemptions(coupon_id, user_id, amount, times_used, redeemed_at)
+        VALUES(?,?,?,1,?)
+        ON CONFLICT(coupon_id, user_id) DO UPDATE
+        SET times_used=COALESCE(times_used, 0)+1, redeemed_at=excluded.redeemed_at
+        WHERE ?=0 OR COALESCE(times_used, 0)<?
+        RETURNING times_used
+        """,
+        (coupon["id"], user_id, amount, now, per_user_limit, per_user_limit),
         fetchone=True,
     )
-    per_user_limit = int(coupon.get("usage_limit_per_user") or 1)
-    existing_uses = int(redemption.get("times_used") or 0) if redemption else 0
-    if per_user_limit and existing_uses >= per_user_limit:
+    if redemption is None:
         return False, None, "سقف استفاده شما از این کد تکمیل شده است."
 
-    success = change_wallet(user_id, amount, "CREDIT", note=f"COUPON:{coupon['code']}")
+    success, balance = change_wallet(user_id, amount, "CREDIT", note=f"COUPON:{coupon['code']}")
     if not success:
-        return False, None, "امکان واریز مبلغ کوپن وجود ندارد."
+        raise _RedemptionAborted("امکان واریز مبلغ کوپن وجود ندارد.")
 
-    now = datetime.now().isoformat(timespec="seconds")
-    if redemption:
-        new_uses = existing_uses + 1
-        db_execute(
-            "UPDATE coupon_redemptions SET times_used=?, redeemed_at=? WHERE id=?",
-            (new_uses, now, redemption["id"]),
-        )
-    else:
-        db_execute(
-            """
-            INSERT INTO coupon_redemptions(coupon_id, user_id, amount, times_used, redeemed_at)
-            VALUES(?,?,?,?,?)
-            """,
-            (coupon["id"], user_id, amount, 1, now),
-        )
-    db_execute(
-        "UPDATE coupons SET used_count=used_count+1, updated_at=? WHERE id=?",
-        (now, coupon["id"]),
-    )
-    user = get_user(user_id)
-    balance = int(user.get("wallet_balance") or 0) if user else 0
     return True, {"amount": amount, "balance": balance, "code": coupon["code"]}, None
 
 
+_PID_RE = re.compile(r"\d+")
+
+
 def _serialize_product_ids(product_ids: Iterable[int]) -> str:
-    return ",".join(str(int(pid)) for pid in product_ids if str(pid).isdigit())
+    return ",".join(str(int(part)) for part in map(str, product_ids) if part.isdigit())
 
 
 def _parse_product_ids(raw: str | None) -> list[int]:
-    if not raw:
-        return []
-    items = []
-    for part in str(raw).split(","):
-        part = part.strip()
-        if part.isdigit():
-            items.append(int(part))
-    return items
+    return [int(part) for part in _PID_RE.findall(raw)] if raw else []
 
 
 def create_discount(
@@ -1041,13 +1618,13 @@ def create_discount(
     product_ids: Iterable[int] | None = None,
     expires_at: str | None = None,
 ) -> int:
-    now = datetime.now().isoformat(timespec="seconds")
+    now = _now_iso()
     normalized = (code or "").strip().upper()
     if not normalized:
         raise ValueError("Discount code cannot be empty")
     per_user = 1 if usage_limit_per_user is None else int(usage_limit_per_user)
     product_list = _serialize_product_ids(product_ids or [])
-    return db_execute(
+    discount_id = db_execute(
         """
         INSERT INTO discounts(
             code, amount, usage_limit, usage_limit_per_user,
@@ -1070,6 +1647,8 @@ def create_discount(
         ),
         return_lastrowid=True,
     )
+    _code_cache_invalidate("discounts")
+    return discount_id
 
 
 def update_discount(
@@ -1084,7 +1663,7 @@ def update_discount(
     expires_at: str | None,
     is_active: bool | int | None = None,
 ) -> bool:
-    now = datetime.now().isoformat(timespec="seconds")
+    now = _now_iso()
     normalized = (code or "").strip().upper()
     if not normalized:
         return False
@@ -1120,65 +1699,51 @@ def update_discount(
         """,
         tuple(params),
     )
+    _code_cache_invalidate("discounts")
     return True
 
 
 def set_discount_active(discount_id: int, active: bool) -> None:
-    now = datetime.now().isoformat(timespec="seconds")
+    now = _now_iso()
     db_execute(
         "UPDATE discounts SET is_active=?, updated_at=? WHERE id=?",
         (1 if active else 0, now, discount_id),
     )
+    _code_cache_invalidate("discounts")
 
 
 def delete_discount(discount_id: int) -> None:
     db_execute("DELETE FROM discounts WHERE id=?", (discount_id,))
+    _code_cache_invalidate("discounts")
 
 
 def list_discounts(limit: int = 100, offset: int = 0) -> list[dict[str, Any]]:
-    rows = db_execute(
-        """
-        SELECT * FROM discounts
-        ORDER BY created_at DESC
-        LIMIT ? OFFSET ?
-        """,
-        (limit, offset),
-        fetchall=True,
-    ) or []
-    for row in rows:
-        if not row.get("expires_at"):
-            row["expires_at"] = None
-        row["usage_limit_per_user"] = int(row.get("usage_limit_per_user") or 1)
-        row["is_active"] = bool(int(row.get("is_active") or 0))
-        row["applies_all"] = bool(int(row.get("applies_all") or 0))
-        row["product_ids"] = _parse_product_ids(row.get("product_ids"))
-    return rows
+    rows = db_execute(_SQL_LIST_DISCOUNTS, (limit, offset), fetchall=True) or []
+    return [_discount_from_row(row) for row in rows]
 
 
 def get_discount(discount_id: int):
-    row = db_execute("SELECT * FROM discounts WHERE id=?", (discount_id,), fetchone=True)
-    if row:
-        if not row.get("expires_at"):
-            row["expires_at"] = None
-        row["usage_limit_per_user"] = int(row.get("usage_limit_per_user") or 1)
-        row["is_active"] = bool(int(row.get("is_active") or 0))
-        row["applies_all"] = bool(int(row.get("applies_all") or 0))
-        row["product_ids"] = _parse_product_ids(row.get("product_ids"))
-    return row
+    row = db_execute(_SQL_GET_DISCOUNT, (discount_id,), fetchone=True)
+    return _discount_from_row(row) if row else None
 
 
-def get_discount_by_code(code: str):
+def get_discount_by_code(code: str, *, fresh: bool = False):
+    """Discount row for ``code``, served from a 30s cache unless ``fresh`` is set.
+
+    Cached rows may lag ``used_count`` by up to the TTL; limit checks must pass ``fresh=True``.
+    """
+
     normalized = (code or "").strip().upper()
     if not normalized:
         return None
-    row = db_execute("SELECT * FROM discounts WHERE UPPER(code)=?", (normalized,), fetchone=True)
+    if not fresh:
+        hit, cached = _code_cache_get("discounts", normalized)
+        if hit:
+            return cached
+    row = db_execute(_SQL_GET_DISCOUNT_BY_CODE, (normalized,), fetchone=True)
     if row:
-        if not row.get("expires_at"):
-            row["expires_at"] = None
-        row["usage_limit_per_user"] = int(row.get("usage_limit_per_user") or 1)
-        row["is_active"] = bool(int(row.get("is_active") or 0))
-        row["applies_all"] = bool(int(row.get("applies_all") or 0))
-        row["product_ids"] = _parse_product_ids(row.get("product_ids"))
+        _discount_from_row(row)
+    _code_cache_put("discounts", normalized, row)
     return row
 
 
@@ -1210,163 +1775,172 @@ def _order_product_id(order: dict | None) -> int | None:
 def apply_discount_to_order(
     order_id: int, user_id: int, code: str
 ) -> tuple[bool, dict[str, Any] | None, str | None]:
-    order = get_order(order_id)
-    if not order or order.get("user_id") != user_id:
-        return False, None, "سفارش نامعتبر است."
-    if order.get("status") != "AWAITING_PAYMENT":
-        return False, None, "وضعیت سفارش اجازه ثبت تخفیف نمی‌دهد."
-    if (order.get("discount_code") or "").strip():
-        return False, None, "روی این سفارش قبلاً کد تخفیف ثبت شده است."
-
-    normalized = (code or "").strip().upper()
-    if not normalized:
-        return False, None, "کد تخفیف نامعتبر است."
-    discount = get_discount_by_code(normalized)
-    if not discount:
-        return False, None, "کد تخفیف یافت نشد."
-    if not discount.get("is_active"):
+    cached = get_discount_by_code(code)
+    if cached is None or not cached.get("is_active"):
+        # unknown or disabled: answer from the cache without taking the write lock
+        if not (code or "").strip():
+            return False, None, "کد تخفیف نامعتبر است."
+        if cached is None:
+            return False, None, "کد تخفیف یافت نشد."
         return False, None, "این کد تخفیف غیرفعال است."
 
-    try:
-        amount = int(discount.get("amount") or 0)
-    except (TypeError, ValueError):
-        amount = 0
-    if amount <= 0:
-        return False, None, "مبلغ تخفیف معتبر نیست."
-
-    limit = int(discount.get("usage_limit") or 0)
-    used = int(discount.get("used_count") or 0)
-    if limit and used >= limit:
-        return False, None, "ظرفیت استفاده از این کد تکمیل شده است."
+    normalized = (code or "").strip().upper()
+    # checks and writes share one BEGIN IMMEDIATE, so two requests cannot both
+    # pass the usage-limit checks before either records its redemption
+    with db_transaction():
+        # the order and the discount it names come back together in one lookup
+        order = db_execute(
+            """
+            SELECT o.user_id, o.status, o.discount_code, o.service_code, o.amount_total, o.price,
+                   d.id AS d_id, d.code AS d_code, d.amount AS d_amount, d.usage_limit,
+                   COALESCE(NULLIF(d.usage_limit_per_user, 0), 1) AS usage_limit_per_user,
+                   d.used_count, COALESCE(d.is_active, 0) != 0 AS is_active,
+                   COALESCE(d.applies_all, 0) != 0 AS applies_all, d.product_ids,
+                   NULLIF(d.expires_at, '') AS expires_at
+            FROM orders AS o
+            LEFT JOIN discounts AS d ON d.code=?
+            WHERE o.id=?
+            """,
+            (normalized, order_id),
+            fetchone=True,
+        )
+        if not order or order.get("user_id") != user_id:
+            return False, None, "سفارش نامعتبر است."
+        if order.get("status") != "AWAITING_PAYMENT":
+            return False, None, "وضعیت سفارش اجازه ثبت تخفیف نمی‌دهد."
+        if (order.get("discount_code") or "").strip():
+            return False, None, "روی این سفارش قبلاً کد تخفیف ثبت شده است."
+
+        if order["d_id"] is None:
+            return False, None, "کد تخفیف یافت نشد."
+        discount = {
+            "id": order["d_id"],
+            "code": order["d_code"],
+            "amount": order["d_amount"],
+            "usage_limit": order["usage_limit"],
+            "usage_limit_per_user": order["usage_limit_per_user"],
+            "used_count": order["used_count"],
+            "is_active": bool(order["is_active"]),
+            "applies_all": bool(order["applies_all"]),
+            "product_ids": _parse_product_ids(order["product_ids"]),
+            "expires_at": order["expires_at"],
+        }
+        if not discount.get("is_active"):
+            return False, None, "این کد تخفیف غیرفعال است."
 
-    expires_at = discount.get("expires_at")
-    if expires_at:
         try:
-            expire_dt = datetime.fromisoformat(str(expires_at))
-            if datetime.now() > expire_dt:
-                return False, None, "تاریخ انقضای این کد گذشته است."
-        except ValueError:
-            pass
-
-    product_id = _order_product_id(order)
-    if product_id is None:
-        return False, None, "این کد فقط برای محصولات اعمال می‌شود."
-    allowed_products = discount.get("product_ids") or []
-    if (not discount.get("applies_all")) and allowed_products and product_id not in allowed_products:
-        return False, None, "این کد برای محصول انتخاب‌شده معتبر نیست."
-
-    redemption = db_execute(
-        "SELECT id, times_used FROM discount_redemptions WHERE discount_id=? AND user_id=?",
-        (discount["id"], user_id),
-        fetchone=True,
-    )
-    per_user_limit = int(discount.get("usage_limit_per_user") or 1)
-    existing_uses = int(redemption.get("times_used") or 0) if redemption else 0
-    if per_user_limit and existing_uses >= per_user_limit:
-        return False, None, "سقف استفاده شما از این کد تکمیل شده است."
-
-    base_amount = int(order.get("amount_total") or order.get("price") or 0)
-    discount_value = min(max(amount, 0), max(base_amount, 0))
-    payable = max(base_amount - discount_value, 0)
-
-    now = datetime.now().isoformat(timespec="seconds")
-    db_execute(
-        """
-        UPDATE orders
-        SET discount_id=?, discount_code=?, discount_amount=?, updated_at=?
-        WHERE id=?
-        """,
-        (discount["id"], discount["code"], discount_value, now, order_id),
-    )
-
-    if redemption:
-        new_uses = existing_uses + 1
-        db_execute(
-            "UPDATE discount_redemptions SET times_used=?, order_id=?, redeemed_at=? WHERE id=?",
-            (new_uses, order_id, now, redemption["id"]),
-        )
-    else:
-        db_execute(
+            amount = int(discount.get("amount") or 0)
+        except (TypeError, ValueError):
+            amount = 0
+        if amount <= 0:
+            return False, None, "مبلغ تخفیف معتبر نیست."
+
+        limit = int(discount.get("usage_limit") or 0)
+        used = int(discount.get("used_count") or 0)
+        if limit and used >= limit:
+            return False, None, "ظرفیت استفاده از این کد تکمیل شده است."
+
+        # one clock read serves both the expiry check and the timestamps written below
+        current = datetime.now()
+        expires_at = discount.get("expires_at")
+        if expires_at:
+            try:
+                expire_dt = datetime.fromisoformat(str(expires_at))
+                if current > expire_dt:
+                    return False, None, "تاریخ انقضای این کد گذشته است."
+            except ValueError:
+                pass
+
+        product_id = _order_product_id(order)
+        if product_id is None:
+            return False, None, "این کد فقط برای محصولات اعمال می‌شود."
+        allowed_products = discount.get("product_ids") or []
+        if (not discount.get("applies_all")) and allowed_products and product_id not in allowed_products:
+            return False, None, "این کد برای محصول انتخاب‌شده معتبر نیست."
+
+        base_amount = int(order.get("amount_total") or order.get("price") or 0)
+        discount_value = min(max(amount, 0), max(base_amount, 0))
+        payable = max(base_amount - discount_value, 0)
+
+        now = current.isoformat(timespec="seconds")
+        per_user_limit = int(discount.get("usage_limit_per_user") or 1)
+        redemption = db_execute(
             """
             INSERT INTO discount_redemptions(discount_id, user_id, order_id, amount, times_used, redeemed_at)
-            VALUES(?,?,?,?,?,?)
+            VALUES(?,?,?,?,1,?)
+            ON CONFLICT(discount_id, user_id) DO UPDATE
+            SET times_used=COALESCE(times_used, 0)+1, order_id=excluded.order_id,
+                redeemed_at=excluded.redeemed_at
+            WHERE ?=0 OR COALESCE(times_used, 0)<?
+            RETURNING times_used
             """,
-            (discount["id"], user_id, order_id, discount_value, 1, now),
+            (discount["id"], user_id, order_id, discount_value, now, per_user_limit, per_user_limit),
+            fetchone=True,
         )
+        if redemption is None:
+            return False, None, "سقف استفاده شما از این کد تکمیل شده است."
 
-    db_execute(
-        "UPDATE discounts SET used_count=used_count+1, updated_at=? WHERE id=?",
-        (now, discount["id"]),
-    )
+        db_execute(
+            """
+            UPDATE orders
+            SET discount_id=?, discount_code=?, discount_amount=?, updated_at=?
+            WHERE id=?
+            """,
+            (discount["id"], discount["code"], discount_value, now, order_id),
+        )
 
-    return True, {"discount": discount_value, "payable": payable, "code": discount["code"]}, None
+        return True, {"discount": discount_value, "payable": payable, "code": discount["code"]}, None
 
 
 # ====== Stats & History ======
 def get_user_stats(user_id: int):
-    u = db_execute("SELECT * FROM users WHERE user_id=?", (user_id,), fetchone=True) or {}
-    total = db_execute("SELECT COUNT(*) AS c FROM orders WHERE user_id=?", (user_id,), fetchone=True)["c"]
     # در حال انجام: پس از تایید پرداخت تا قبل از تحویل
-    inprog = db_execute("""
-        SELECT COUNT(*) AS c FROM orders
-        WHERE user_id=? AND status IN ('PENDING_CONFIRM','PENDING_PLAN','APPROVED','IN_PROGRESS','READY_TO_DELIVER')
-    """, (user_id,), fetchone=True)["c"]
-    done = db_execute("""
-        SELECT COUNT(*) AS c FROM orders
-        WHERE user_id=? AND status IN ('DELIVERED','COMPLETED')
-    """, (user_id,), fetchone=True)["c"]
+    row = db_execute(f"""
+        SELECT u.wallet_balance, u.ref_count, u.earnings_total,
+               o.total, o.inprog, o.done
+        FROM (
+            SELECT COUNT(*) AS total, SUM({_INPROG_IN}) AS inprog, SUM({_DONE_IN}) AS done
+            FROM orders WHERE user_id=?
+        ) AS o
+        LEFT JOIN users AS u ON u.user_id=?
+    """, (*_INPROG_STATUSES, *_DONE_STATUSES, user_id, user_id), fetchone=True) or {}
     return {
-        "wallet_balance": int(u.get("wallet_balance") or 0),
-        "ref_count": int(u.get("ref_count") or 0),
-        "earnings_total": int(u.get("earnings_total") or 0),
-        "orders_total": int(total or 0),
-        "orders_inprog": int(inprog or 0),
-        "orders_done": int(done or 0),
+        "wallet_balance": int(row.get("wallet_balance") or 0),
+        "ref_count": int(row.get("ref_count") or 0),
+        "earnings_total": int(row.get("earnings_total") or 0),
+        "orders_total": int(row.get("total") or 0),
+        "orders_inprog": int(row.get("inprog") or 0),
+        "orders_done": int(row.get("done") or 0),
     }
 
-def list_orders_by_category(user_id: int, category: str, limit: int = 10, offset: int = 0):
-    where = "user_id=?"
-    params = [user_id]
+def _category_filter(user_id: int, category: str) -> tuple[str, list[Any]]:
     if category == "inprog":
-        where += " AND status IN ('PENDING_CONFIRM','PENDING_PLAN','APPROVED','IN_PROGRESS','READY_TO_DELIVER')"
-    elif category == "done":
-        where += " AND status IN ('DELIVERED','COMPLETED')"
-    elif category == "all":
-        where += " AND 1=1"
-    else:
-        where += " AND 1=0"  # ناشناخته
+        return f"user_id=? AND {_INPROG_IN}", [user_id, *_INPROG_STATUSES]
+    if category == "done":
+        return f"user_id=? AND {_DONE_IN}", [user_id, *_DONE_STATUSES]
+    if category == "all":
+        return "user_id=?", [user_id]
+    return "user_id=? AND 1=0", [user_id]  # ناشناخته
 
+def list_orders_by_category(user_id: int, category: str, limit: int = 10, offset: int = 0):
+    where, params = _category_filter(user_id, category)
     sql = f"SELECT * FROM orders WHERE {where} ORDER BY id DESC LIMIT ? OFFSET ?"
     params += [limit, offset]
     return db_execute(sql, tuple(params), fetchall=True)
 
+def list_orders_by_category_with_total(user_id: int, category: str, limit: int = 10, offset: int = 0):
+    where, params = _category_filter(user_id, category)
+    return _page_with_total("orders", where, params, "id DESC", limit, offset)
+
 def count_orders_by_category(user_id: int, category: str):
-    where = "user_id=?"
-    params = [user_id]
-    if category == "inprog":
-        where += " AND status IN ('PENDING_CONFIRM','PENDING_PLAN','APPROVED','IN_PROGRESS','READY_TO_DELIVER')"
-    elif category == "done":
-        where += " AND status IN ('DELIVERED','COMPLETED')"
-    elif category == "all":
-        where += " AND 1=1"
-    else:
-        where += " AND 1=0"
-    sql = f"SELECT COUNT(*) AS c FROM orders WHERE {where}"
-    r = db_execute(sql, tuple(params), fetchone=True)
-    return int(r["c"] if r else 0)
+    where, params = _category_filter(user_id, category)
+    sql = f"SELECT COUNT(*) FROM orders WHERE {where}"
+    return int(db_execute(sql, tuple(params), fetchval=True) or 0)
 
 # ===== User phone verification (auto-migrate columns if missing) =====
 def set_user_phone_verified(user_id: int, phone: str):
-    # add columns if not exists (SQLite trick: try/except)
-    try:
-        db_execute("ALTER TABLE users ADD COLUMN phone TEXT", (), commit=True)
-    except Exception:
-        pass
-    try:
-        db_execute("ALTER TABLE users ADD COLUMN phone_verified INTEGER DEFAULT 0", (), commit=True)
-    except Exception:
-        pass
-    db_execute("UPDATE users SET phone=?, phone_verified=1 WHERE id=?", (phone, user_id))
+    # phone/phone_verified are created by the schema migrations in init_db
+    db_execute("UPDATE users SET phone=?, phone_verified=1 WHERE user_id=?", (phone, user_id))
     return True
 
 
@@ -1400,68 +1974,71 @@ def _build_where(parts: Iterable[str]) -> str:
     return " AND ".join(clauses) if clauses else "1=1"
 
 
+def _text_search_filter(
+    term: str, fts: str, key: str, columns: tuple[str, ...]
+) -> tuple[str, list[Any]]:
+    """WHERE fragment matching ``term`` as a substring of any of ``columns``."""
+
+    # trigrams need at least three characters; shorter terms fall back to a scan
+    if len(term) >= 3:
+        phrase = '"' + term.replace('"', '""') + '"'
+        return f"{key} IN (SELECT rowid FROM {fts} WHERE {fts} MATCH ?)", [phrase]
+    like = f"%{term.lower()}%"
+    return "(" + " OR ".join(f"LOWER({c}) LIKE ?" for c in columns) + ")", [like] * len(columns)
+
+
 def get_dashboard_snapshot():
     now = datetime.now()
     last_7_days = (now - timedelta(days=7)).isoformat(timespec="seconds")
     last_30_days = (now - timedelta(days=30)).isoformat(timespec="seconds")
 
-    totals = db_execute(
-        "SELECT COUNT(*) AS total FROM orders",
-        fetchone=True,
-    ) or {"total": 0}
-    users = db_execute("SELECT COUNT(*) AS total FROM users", fetchone=True) or {"total": 0}
-    status_counts = {
-        row["status"]: row["c"]
-        for row in db_execute(
-            "SELECT status, COUNT(*) AS c FROM orders GROUP BY status",
-            fetchall=True,
-        )
-    }
+    # one round-trip: the trigger-maintained status/wallet totals, the recent-orders
+    # window (an index range on created_at) and the user count
+    rows = db_execute(
+        """
+        SELECT 'order' AS kind, NULLIF(status, '') AS key, cnt AS c, revenue,
+               NULL AS revenue_30, NULL AS new_week
+        FROM orders_summary WHERE cnt > 0
+        UNION ALL
+        SELECT 'recent', NULL, NULL, NULL, SUM(amount_total), SUM(created_at >= ?)
+        FROM orders WHERE created_at >= ?
+        UNION ALL
+        SELECT 'user', NULL, COUNT(*), NULL, NULL, NULL FROM users
+        UNION ALL
+        SELECT 'wallet', NULLIF(type, ''), NULL, total, NULL, NULL FROM wallet_summary
+        """,
+        (last_7_days, last_30_days),
+        fetchall=True,
+    )
+    status_counts: dict[str, int] = {}
+    wallet_totals: dict[str, int] = {}
+    users_total = orders_total = revenue_total = revenue_30 = new_orders_week = 0
+    for row in rows:
+        kind = row["kind"]
+        if kind == "order":
+            status_counts[row["key"]] = row["c"]
+            orders_total += row["c"]
+            if row["key"] in ("APPROVED", "IN_PROGRESS", "READY_TO_DELIVER", "DELIVERED", "COMPLETED"):
+                revenue_total += row["revenue"] or 0
+        elif kind == "recent":
+            revenue_30 = row["revenue_30"] or 0
+            new_orders_week = row["new_week"] or 0
+        elif kind == "user":
+            users_total = row["c"]
+        else:
+            wallet_totals[row["key"]] = row["revenue"]
+
     awaiting = status_counts.get("AWAITING_PAYMENT", 0)
     pending = status_counts.get("PENDING_CONFIRM", 0)
     in_queue = sum(
         status_counts.get(code, 0)
         for code in ("APPROVED", "IN_PROGRESS", "READY_TO_DELIVER")
     )
-    delivered = sum(
-        status_counts.get(code, 0)
-        for code in ("DELIVERED", "COMPLETED")
-    )
-
-    revenue_total = db_execute(
-        """
-        SELECT COALESCE(SUM(amount_total), 0) AS total
-        FROM orders
-        WHERE status IN ('APPROVED','IN_PROGRESS','READY_TO_DELIVER','DELIVERED','COMPLETED')
-        """,
-        fetchone=True,
-    )["total"]
-    revenue_30 = db_execute(
-        """
-        SELECT COALESCE(SUM(amount_total), 0) AS total
-        FROM orders
-        WHERE created_at >= ?
-    """,
-        (last_30_days,),
-        fetchone=True,
-    )["total"]
-    new_orders_week = db_execute(
-        "SELECT COUNT(*) AS c FROM orders WHERE created_at >= ?",
-        (last_7_days,),
-        fetchone=True,
-    )["c"]
-
-    wallet_totals = {
-        row["type"]: row["total"]
-        for row in db_execute(
-            "SELECT type, COALESCE(SUM(amount), 0) AS total FROM wallet_tx GROUP BY type",
-            fetchall=True,
-        )
-    }
+    delivered = sum(status_counts.get(code, 0) for code in _DONE_STATUSES)
 
     return {
-        "orders_total": totals["total"],
-        "users_total": users["total"],
+        "orders_total": orders_total,
+        "users_total": users_total,
         "awaiting_payment": awaiting,
         "pending_confirm": pending,
         "in_queue": in_queue,
@@ -1498,14 +2075,9 @@ def list_recent_wallet_tx(limit: int = 10):
     )
 
 
-def list_orders(
-    *,
-    status: str | None = None,
-    search: str | None = None,
-    limit: int = 20,
-    offset: int = 0,
-    user_id: int | None = None,
-):
+def _order_filters(
+    status: str | None, search: str | None, user_id: int | None
+) -> tuple[str, list[Any]]:
     where_parts: list[str] = []
     params: list[Any] = []
 
@@ -1524,45 +2096,68 @@ def list_orders(
             where_parts.append("id=?")
             params.append(int(term))
         else:
-            like = f"%{term.lower()}%"
-            where_parts.append(
-                "(LOWER(username) LIKE ? OR LOWER(first_name) LIKE ? OR LOWER(plan_title) LIKE ? OR LOWER(customer_email) LIKE ?)"
-            )
-            params.extend([like, like, like, like])
+            clause, clause_params = _text_search_filter(term, "orders_fts", "id", _SEARCH_INDEXES["orders_fts"][2])
+            where_parts.append(clause)
+            params.extend(clause_params)
+
+    return _build_where(where_parts), params
+
+
+def _page_with_total(
+    table: str, where_sql: str, params: list[Any], order_by: str, limit: int, offset: int
+) -> tuple[list[dict[str, Any]], int]:
+    """One page of ``table`` plus the unpaged row count, computed in the same query."""
+
+    rows = db_execute(
+        f"SELECT *, COUNT(*) OVER() AS __total FROM {table} WHERE {where_sql} "
+        f"ORDER BY {order_by} LIMIT ? OFFSET ?",
+        (*params, limit, offset),
+        fetchall=True,
+    )
+    if not rows:
+        # past the last page the window has nothing to report on
+        if not offset:
+            return [], 0
+        result = db_execute(f"SELECT COUNT(*) FROM {table} WHERE {where_sql}", tuple(params), fetchval=True)
+        return [], int(result or 0)
+    total = rows[0]["__total"]
+    for row in rows:
+        del row["__total"]
+    return rows, int(total)
+
 
-    where_sql = _build_where(where_parts)
+def list_orders(
+    *,
+    status: str | None = None,
+    search: str | None = None,
+    limit: int = 20,
+    offset: int = 0,
+    user_id: int | None = None,
+):
+    where_sql, params = _order_filters(status, search, user_id)
     sql = f"SELECT * FROM orders WHERE {where_sql} ORDER BY created_at DESC LIMIT ? OFFSET ?"
     params.extend([limit, offset])
     return db_execute(sql, tuple(params), fetchall=True)
 
 
-def count_orders(status: str | None = None, search: str | None = None, user_id: int | None = None) -> int:
-    where_parts: list[str] = []
-    params: list[Any] = []
-    if user_id is not None:
-        where_parts.append("user_id=?")
-        params.append(user_id)
-    if status and status != "all":
-        where_parts.append("status=?")
-        params.append(status)
-    if search:
-        term = search.strip()
-        if term.startswith("#"):
-            term = term[1:]
-        if term.isdigit():
-            where_parts.append("id=?")
-            params.append(int(term))
-        else:
-            like = f"%{term.lower()}%"
-            where_parts.append(
-                "(LOWER(username) LIKE ? OR LOWER(first_name) LIKE ? OR LOWER(plan_title) LIKE ? OR LOWER(customer_email) LIKE ?)"
-            )
-            params.extend([like, like, like, like])
+def list_orders_with_total(
+    *,
+    status: str | None = None,
+    search: str | None = None,
+    limit: int = 20,
+    offset: int = 0,
+    user_id: int | None = None,
+) -> tuple[list[dict[str, Any]], int]:
+    """``list_orders`` and ``count_orders`` for the same filters in one query."""
 
-    where_sql = _build_where(where_parts)
-    sql = f"SELECT COUNT(*) AS c FROM orders WHERE {where_sql}"
-    result = db_execute(sql, tuple(params), fetchone=True)
-    return int(result["c"] if result else 0)
+    where_sql, params = _order_filters(status, search, user_id)
+    return _page_with_total("orders", where_sql, params, "created_at DESC", limit, offset)
+
+
+def count_orders(status: str | None = None, search: str | None = None, user_id: int | None = None) -> int:
+    where_sql, params = _order_filters(status, search, user_id)
+    sql = f"SELECT COUNT(*) FROM orders WHERE {where_sql}"
+    return int(db_execute(sql, tuple(params), fetchval=True) or 0)
 
 
 def update_order_notes(order_id: int, notes: str) -> None:
@@ -1577,52 +2172,54 @@ def list_wallet_tx_for_order(order_id: int) -> list[dict[str, Any]]:
     )
 
 
-def list_users(search: str | None = None, limit: int = 20, offset: int = 0):
+def _user_filters(search: str | None) -> tuple[str, list[Any]]:
     where_parts: list[str] = []
     params: list[Any] = []
     if search:
         term = search.strip()
-        like = f"%{term.lower()}%"
         if term.isdigit():
             where_parts.append("user_id=?")
             params.append(int(term))
-        where_parts.append("(LOWER(username) LIKE ? OR LOWER(first_name) LIKE ?)")
-        params.extend([like, like])
-    where_sql = _build_where(where_parts)
+        clause, clause_params = _text_search_filter(term, "users_fts", "user_id", _SEARCH_INDEXES["users_fts"][2])
+        where_parts.append(clause)
+        params.extend(clause_params)
+    return _build_where(where_parts), params
+
+
+def list_users(search: str | None = None, limit: int = 20, offset: int = 0):
+    where_sql, params = _user_filters(search)
     sql = f"SELECT * FROM users WHERE {where_sql} ORDER BY created_at DESC LIMIT ? OFFSET ?"
     params.extend([limit, offset])
     return db_execute(sql, tuple(params), fetchall=True)
 
 
+def list_users_with_total(
+    search: str | None = None, limit: int = 20, offset: int = 0
+) -> tuple[list[dict[str, Any]], int]:
+    where_sql, params = _user_filters(search)
+    return _page_with_total("users", where_sql, params, "created_at DESC", limit, offset)
+
+
 def count_users(search: str | None = None) -> int:
-    where_parts: list[str] = []
-    params: list[Any] = []
-    if search:
-        term = search.strip()
-        like = f"%{term.lower()}%"
-        if term.isdigit():
-            where_parts.append("user_id=?")
-            params.append(int(term))
-        where_parts.append("(LOWER(username) LIKE ? OR LOWER(first_name) LIKE ?)")
-        params.extend([like, like])
-    where_sql = _build_where(where_parts)
-    sql = f"SELECT COUNT(*) AS c FROM users WHERE {where_sql}"
-    result = db_execute(sql, tuple(params), fetchone=True)
-    return int(result["c"] if result else 0)
+    where_sql, params = _user_filters(search)
+    sql = f"SELECT COUNT(*) FROM users WHERE {where_sql}"
+    return int(db_execute(sql, tuple(params), fetchval=True) or 0)
 
 
 def set_user_blocked(user_id: int, blocked: bool) -> None:
     db_execute(
         "UPDATE users SET is_blocked=?, updated_at=? WHERE user_id=?",
-        (1 if blocked else 0, datetime.now().isoformat(timespec="seconds"), user_id),
+        (1 if blocked else 0, _now_iso(), user_id),
     )
 
 
 def is_user_blocked(user_id: int) -> bool:
-    user = get_user(user_id)
-    if not user:
-        return False
-    return bool(int(user.get("is_blocked") or 0))
+    blocked = db_execute(
+        "SELECT COALESCE(is_blocked, 0) != 0 FROM users WHERE user_id=?",
+        (user_id,),
+        fetchval=True,
+    )
+    return bool(blocked)
 
 
 def list_wallet_tx_for_user(user_id: int, limit: int = 20):
@@ -1633,16 +2230,42 @@ def list_wallet_tx_for_user(user_id: int, limit: int = 20):
     )
 
 
+def list_wallet_tx_for_users(user_ids: Iterable[int], limit_per_user: int = 20) -> dict[int, list[dict[str, Any]]]:
+    """Latest ``limit_per_user`` transactions for each user, fetched in one query."""
+
+    ids = list(dict.fromkeys(int(uid) for uid in user_ids))
+    result: dict[int, list[dict[str, Any]]] = {uid: [] for uid in ids}
+    if not ids:
+        return result
+    placeholders = ",".join("?" * len(ids))
+    rows = db_execute(
+        f"""
+        SELECT * FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY created_at DESC) AS rn
+            FROM wallet_tx WHERE user_id IN ({placeholders})
+        ) WHERE rn<=? ORDER BY user_id, rn
+        """,
+        (*ids, limit_per_user),
+        fetchall=True,
+    )
+    for row in rows:
+        del row["rn"]
+        result[row["user_id"]].append(row)
+    return result
+
+
 def get_wallet_summary():
-    totals = db_execute(
-        "SELECT type, COALESCE(SUM(amount), 0) AS total FROM wallet_tx GROUP BY type",
+    # per-type totals (trigger-maintained) and the sum of balances in one round-trip
+    rows = db_execute(
+        """
+        SELECT 'tx' AS kind, NULLIF(type, '') AS type, total FROM wallet_summary
+        UNION ALL
+        SELECT 'balance', NULL, COALESCE(SUM(wallet_balance), 0) FROM users
+        """,
         fetchall=True,
     )
-    by_type = {row["type"]: row["total"] for row in totals}
-    balance_total = db_execute(
-        "SELECT COALESCE(SUM(wallet_balance), 0) AS total FROM users",
-        fetchone=True,
-    )["total"]
+    by_type = {row["type"]: row["total"] for row in rows if row["kind"] == "tx"}
+    balance_total = next((row["total"] for row in rows if row["kind"] == "balance"), 0)
     return {
         "by_type": by_type,
         "user_balances": balance_total or 0,
@@ -1657,7 +2280,7 @@ def create_service_message(
     message_text: str,
     attachment_file_id: str | None = None,
 ) -> int:
-    now = datetime.now().isoformat(timespec="seconds")
+    now = _now_iso()
     return db_execute(
         """
         INSERT INTO service_messages(user_id, username, first_name, category, message_text, attachment_file_id, created_at, updated_at)
@@ -1677,33 +2300,41 @@ def create_service_message(
     )
 
 
+def _service_message_filters(category: str | None) -> tuple[str, list[Any]]:
+    where_parts: list[str] = []
+    params: list[Any] = []
+    if category:
+        where_parts.append("category=?")
+        params.append(category)
+    return _build_where(where_parts), params
+
+
 def list_service_messages(
     *,
     category: str | None = None,
     limit: int = 20,
     offset: int = 0,
 ) -> list[dict[str, Any]]:
-    where_parts: list[str] = []
-    params: list[Any] = []
-    if category:
-        where_parts.append("category=?")
-        params.append(category)
-    where_sql = _build_where(where_parts)
+    where_sql, params = _service_message_filters(category)
     sql = f"SELECT * FROM service_messages WHERE {where_sql} ORDER BY created_at DESC LIMIT ? OFFSET ?"
     params.extend([limit, offset])
     return db_execute(sql, tuple(params), fetchall=True)
 
 
+def list_service_messages_with_total(
+    *,
+    category: str | None = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> tuple[list[dict[str, Any]], int]:
+    where_sql, params = _service_message_filters(category)
+    return _page_with_total("service_messages", where_sql, params, "created_at DESC", limit, offset)
+
+
 def count_service_messages(category: str | None = None) -> int:
-    where_parts: list[str] = []
-    params: list[Any] = []
-    if category:
-        where_parts.append("category=?")
-        params.append(category)
-    where_sql = _build_where(where_parts)
-    sql = f"SELECT COUNT(*) AS c FROM service_messages WHERE {where_sql}"
-    result = db_execute(sql, tuple(params), fetchone=True)
-    return int(result["c"] if result else 0)
+    where_sql, params = _service_message_filters(category)
+    sql = f"SELECT COUNT(*) FROM service_messages WHERE {where_sql}"
+    return int(db_execute(sql, tuple(params), fetchval=True) or 0)
 
 
 def get_service_message(message_id: int) -> dict[str, Any] | None:
@@ -1715,7 +2346,7 @@ def get_service_message(message_id: int) -> dict[str, Any] | None:
 
 
 def add_service_message_reply(message_id: int, user_id: int | None, text: str) -> int:
-    now = datetime.now().isoformat(timespec="seconds")
+    now = _now_iso()
     return db_execute(
         """
         INSERT INTO service_message_replies(service_message_id, user_id, message_text, created_at)
@@ -1741,7 +2372,7 @@ def list_service_message_replies(message_id: int) -> list[dict[str, Any]]:
 def set_service_message_status(message_id: int, resolved: bool) -> None:
     db_execute(
         "UPDATE service_messages SET is_resolved=?, updated_at=? WHERE id=?",
-        (1 if resolved else 0, datetime.now().isoformat(timespec="seconds"), message_id),
+        (1 if resolved else 0, _now_iso(), message_id),
     )
 
 
@@ -1752,7 +2383,7 @@ def list_products(parent_id: int | None = None) -> list[dict[str, Any]]:
     return db_execute(
         """
         SELECT * FROM products
-        WHERE COALESCE(parent_id, 0)=COALESCE(?, 0)
+        WHERE parent_id IS ?
         ORDER BY sort_order ASC, title ASC
         """,
         (parent_id,),
@@ -1773,11 +2404,11 @@ def has_sort_conflict(
 ) -> bool:
     query = """
         SELECT 1 FROM products
-        WHERE (parent_id IS ? OR parent_id=?)
+        WHERE COALESCE(parent_id, -1)=COALESCE(?, -1)
           AND is_category=?
           AND sort_order=?
     """
-    params: list[Any] = [parent_id, parent_id, 1 if is_category else 0, sort_order]
+    params: list[Any] = [parent_id, 1 if is_category else 0, sort_order]
     if exclude_id:
         query += " AND id != ?"
         params.append(exclude_id)
@@ -1785,6 +2416,167 @@ def has_sort_conflict(
     return bool(row)
 
 
+@dataclass(frozen=True, slots=True)
+class ProductSpec:
+    """Column values for a new product row, in INSERT order."""
+
+    parent_id: int | None = None
+    title: str = ""
+    description: str = ""
+    price: int = 0
+    available: bool = True
+    is_category: bool = False
+    request_only: bool = False
+    account_enabled: bool = False
+    self_available: bool = False
+    self_price: int = 0
+    pre_available: bool = False
+    pre_price: int = 0
+    require_username: bool = False
+    require_password: bool = False
+    allow_first_plan: bool = False
+    cashback_enabled: bool = False
+    cashback_percent: int = 0
+    sort_order: int = 0
+
+
+# Local-time timestamp in the same format as _now_iso(), filled in by SQLite itself
+_SQL_NOW = "strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime')"
+
+_PRODUCT_COLUMNS = tuple(field.name for field in fields(ProductSpec))
+# Reads every spec field into a tuple in one C call
+_product_spec_values = attrgetter(*_PRODUCT_COLUMNS)
+
+_INSERT_PRODUCT_SQL = (
+    f"INSERT INTO products({', '.join(_PRODUCT_COLUMNS)}, created_at, updated_at) "
+    f"VALUES({', '.join('?' * len(_PRODUCT_COLUMNS))}, {_SQL_NOW}, {_SQL_NOW})"
+)
+
+_UPSERT_PRODUCT_SQL = (
+    f"INSERT INTO products(id, {', '.join(_PRODUCT_COLUMNS)}, created_at, updated_at) "
+    f"VALUES(?, {', '.join('?' * len(_PRODUCT_COLUMNS))}, {_SQL_NOW}, {_SQL_NOW}) "
+    f"ON CONFLICT(id) DO UPDATE SET "
+    f"{', '.join(f'{name}=excluded.{name}' for name in _PRODUCT_COLUMNS)}, "
+    f"updated_at=excluded.updated_at "
+    f"RETURNING id"
+)
+
+# Coercions applied to product columns on write: flags are stored as 0/1 and
+# prices/percentages are clamped to non-negative integers. Flags stay one column
+# each: SQLite records the integers 0 and 1 in the row header alone (serial types
+# 8/9, no payload bytes), so a packed bitfield would save next to nothing.
+_PRODUCT_BOOL_COLS = (
+    "available",
+    "is_category",
+    "request_only",
+    "account_enabled",
+    "self_available",
+    "pre_available",
+    "require_username",
+    "require_password",
+    "allow_first_plan",
+    "cashback_enabled",
+)
+_PRODUCT_NNINT_COLS = ("price", "self_price", "pre_price", "cashback_percent")
+
+
+def _as_flag(value: Any) -> int:
+    return 1 if value else 0
+
+
+def _as_nonneg_int(value: Any) -> int:
+    return max(int(value), 0)
+
+
+def _as_is(value: Any) -> Any:
+    return value
+
+
+_PRODUCT_COERCERS = {
+    **{name: _as_flag for name in _PRODUCT_BOOL_COLS},
+    **{name: _as_nonneg_int for name in _PRODUCT_NNINT_COLS},
+}
+
+# (UPDATE statement, per-column coercers) keyed by the tuple of columns being set;
+# callers only ever use a handful of shapes, so each is built once and then
+# served from here
+_PRODUCT_UPDATE_PLANS: dict[tuple[str, ...], tuple[str, tuple[Callable[[Any], Any], ...]]] = {}
+
+
+def _product_update_plan(columns: tuple[str, ...]) -> tuple[str, tuple[Callable[[Any], Any], ...]]:
+    plan = _PRODUCT_UPDATE_PLANS.get(columns)
+    if plan is None:
+        assignments = "".join(f"{name}=?, " for name in columns)
+        # rows whose values already match are left alone (no write, no updated_at bump)
+        changed = " OR ".join(f"{name} IS NOT ?" for name in columns)
+        sql = (
+            f"UPDATE products SET {assignments}updated_at={_SQL_NOW} "
+            f"WHERE id=? AND ({changed}) RETURNING id"
+        )
+        coercers = tuple(_PRODUCT_COERCERS.get(name, _as_is) for name in columns)
+        plan = _PRODUCT_UPDATE_PLANS[columns] = (sql, coercers)
+    return plan
+
+
+def _pack_product(spec: ProductSpec) -> tuple:
+    (
+        parent_id,
+        title,
+        description,
+        price,
+        available,
+        is_category,
+        request_only,
+        account_enabled,
+        self_available,
+        self_price,
+        pre_available,
+        pre_price,
+        require_username,
+        require_password,
+        allow_first_plan,
+        cashback_enabled,
+        cashback_percent,
+        sort_order,
+    ) = _product_spec_values(spec)
+    return (
+        parent_id,
+        str(title).strip(),
+        description or "",
+        max(int(price or 0), 0),
+        1 if available else 0,
+        1 if is_category else 0,
+        1 if request_only else 0,
+        1 if account_enabled else 0,
+        1 if self_available else 0,
+        max(int(self_price or 0), 0),
+        1 if pre_available else 0,
+        max(int(pre_price or 0), 0),
+        1 if require_username else 0,
+        1 if require_password else 0,
+        1 if allow_first_plan else 0,
+        1 if cashback_enabled else 0,
+        max(int(cashback_percent or 0), 0),
+        sort_order,
+    )
+
+
+def create_products_bulk(specs: Iterable[ProductSpec]) -> list[int]:
+    """Insert many products with one prepared statement in one transaction.
+
+    The new ids are returned in input order.
+    """
+
+    rows = list(map(_pack_product, specs))
+    if not rows:
+        return []
+    with db_transaction():
+        db_execute(_INSERT_PRODUCT_SQL, rows, many=True)
+        # AUTOINCREMENT under our write lock hands out a contiguous block ending here
+        last_id = db_execute("SELECT last_insert_rowid()", fetchval=True)
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
 def create_product(
     title: str,
     *,
@@ -1806,41 +2598,37 @@ def create_product(
     cashback_percent: int = 0,
     sort_order: int = 0,
 ) -> int:
-    now = datetime.now().isoformat(timespec="seconds")
-    return db_execute(
-        """
-        INSERT INTO products(
-            parent_id, title, description, price, available, is_category, request_only, account_enabled,
-            self_available, self_price, pre_available, pre_price, require_username, require_password,
-            allow_first_plan, cashback_enabled, cashback_percent,
-            sort_order, created_at, updated_at
-        )
-        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """,
-        (
-            parent_id,
-            title.strip(),
-            description or "",
-            max(int(price), 0),
-            1 if available else 0,
-            1 if is_category else 0,
-            1 if request_only else 0,
-            1 if account_enabled else 0,
-            1 if self_available else 0,
-            max(int(self_price), 0),
-            1 if pre_available else 0,
-            max(int(pre_price), 0),
-            1 if require_username else 0,
-            1 if require_password else 0,
-            1 if allow_first_plan else 0,
-            1 if cashback_enabled else 0,
-            max(int(cashback_percent or 0), 0),
-            sort_order,
-            now,
-            now,
-        ),
-        return_lastrowid=True,
+    spec = ProductSpec(
+        parent_id=parent_id,
+        title=title,
+        description=description,
+        price=price,
+        available=available,
+        is_category=is_category,
+        request_only=request_only,
+        account_enabled=account_enabled,
+        self_available=self_available,
+        self_price=self_price,
+        pre_available=pre_available,
+        pre_price=pre_price,
+        require_username=require_username,
+        require_password=require_password,
+        allow_first_plan=allow_first_plan,
+        cashback_enabled=cashback_enabled,
+        cashback_percent=cashback_percent,
+        sort_order=sort_order,
     )
+    return _insert_returning_id(_INSERT_PRODUCT_SQL, _pack_product(spec))
+
+
+def upsert_product(spec: ProductSpec, product_id: int | None = None) -> int:
+    """Save ``spec`` as product ``product_id``, creating the row if it does not exist.
+
+    Every column is overwritten from the spec (``created_at`` is kept on update).
+    Without an id a new product is inserted. Returns the product id.
+    """
+
+    return db_execute(_UPSERT_PRODUCT_SQL, (product_id, *_pack_product(spec)), fetchval=True)
 
 
 def update_product(
@@ -1865,65 +2653,58 @@ def update_product(
     cashback_percent: int | None = None,
     sort_order: int | None = None,
 ) -> bool:
-    current = get_product(product_id)
-    if not current:
-        return False
-    fields = {
-        "title": title if title is not None else current.get("title"),
-        "description": description if description is not None else current.get("description"),
-        "price": max(int(price), 0) if price is not None else int(current.get("price") or 0),
-        "available": 1 if (available if available is not None else current.get("available")) else 0,
-        "is_category": 1 if (is_category if is_category is not None else current.get("is_category")) else 0,
-        "request_only": 1 if (request_only if request_only is not None else current.get("request_only")) else 0,
-        "account_enabled": 1 if (account_enabled if account_enabled is not None else current.get("account_enabled")) else 0,
-        "self_available": 1 if (self_available if self_available is not None else current.get("self_available")) else 0,
-        "self_price": max(int(self_price), 0) if self_price is not None else int(current.get("self_price") or 0),
-        "pre_available": 1 if (pre_available if pre_available is not None else current.get("pre_available")) else 0,
-        "pre_price": max(int(pre_price), 0) if pre_price is not None else int(current.get("pre_price") or 0),
-        "require_username": 1 if (require_username if require_username is not None else current.get("require_username")) else 0,
-        "require_password": 1 if (require_password if require_password is not None else current.get("require_password")) else 0,
-        "allow_first_plan": 1 if (allow_first_plan if allow_first_plan is not None else current.get("allow_first_plan")) else 0,
-        "cashback_enabled": 1 if (cashback_enabled if cashback_enabled is not None else current.get("cashback_enabled")) else 0,
-        "cashback_percent": max(int(cashback_percent), 0)
-        if cashback_percent is not None
-        else int(current.get("cashback_percent") or 0),
-        "sort_order": sort_order if sort_order is not None else int(current.get("sort_order") or 0),
-        "parent_id": parent_id if parent_id is not None else current.get("parent_id"),
-    }
-    db_execute(
+    # same order as _PRODUCT_COLUMNS, whose names are shared by every call
+    supplied = (
+        parent_id,
+        title,
+        description,
+        price,
+        available,
+        is_category,
+        request_only,
+        account_enabled,
+        self_available,
+        self_price,
+        pre_available,
+        pre_price,
+        require_username,
+        require_password,
+        allow_first_plan,
+        cashback_enabled,
+        cashback_percent,
+        sort_order,
+    )
+    # None means "leave as is", so only the passed columns are written
+    columns = tuple(name for name, value in zip(_PRODUCT_COLUMNS, supplied) if value is not None)
+    if columns:
+        sql, coercers = _product_update_plan(columns)
+        raw = (value for value in supplied if value is not None)
+        params = tuple(coerce(value) for coerce, value in zip(coercers, raw))
+        if db_execute(sql, (*params, product_id, *params), fetchone=True):
+            return True
+    # nothing to change: report whether the product exists
+    return bool(db_execute("SELECT 1 FROM products WHERE id=?", (product_id,), fetchval=True))
+
+
+def delete_product(product_id: int) -> bool:
+    """Delete a product together with its whole subtree in one statement.
+
+    Returns False when the product did not exist.
+    """
+
+    # UNION (not UNION ALL) so a parent_id cycle cannot make the walk run forever;
+    # the CTE sits inside the DELETE so sqlite3 still reports a rowcount
+    deleted = _exec_write(
         """
-        UPDATE products
-        SET title=?, description=?, price=?, available=?, is_category=?, request_only=?, account_enabled=?,
-            self_available=?, self_price=?, pre_available=?, pre_price=?, require_username=?, require_password=?,
-            allow_first_plan=?, cashback_enabled=?, cashback_percent=?,
-            sort_order=?, parent_id=?, updated_at=?
-        WHERE id=?
+        DELETE FROM products WHERE id IN (
+            WITH RECURSIVE subtree(id) AS (
+                SELECT ?
+                UNION
+                SELECT p.id FROM products p JOIN subtree s ON p.parent_id=s.id
+            )
+            SELECT id FROM subtree
+        )
         """,
-        (
-            fields["title"],
-            fields["description"],
-            fields["price"],
-            fields["available"],
-            fields["is_category"],
-            fields["request_only"],
-            fields["account_enabled"],
-            fields["self_available"],
-            fields["self_price"],
-            fields["pre_available"],
-            fields["pre_price"],
-            fields["require_username"],
-            fields["require_password"],
-            fields["allow_first_plan"],
-            fields["cashback_enabled"],
-            fields["cashback_percent"],
-            fields["sort_order"],
-            fields["parent_id"],
-            datetime.now().isoformat(timespec="seconds"),
-            product_id,
-        ),
+        (product_id,),
     )
-    return True
-
-
-def delete_product(product_id: int) -> None:
-    db_execute("DELETE FROM products WHERE id=?", (product_id,))
+    return deleted > 0
@@ -1,10 +1,11 @@
 import asyncio
 import logging
+import uvloop
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.types import BotCommand, BotCommandScopeDefault, MenuButtonCommands
 from .config import BOT_TOKEN, DEFAULT_BOT_PROPS
-from .db import init_db, expire_orders_and_refund
+from .db import init_db, expire_orders_and_refund, optimize_db
 from .products import seed_default_catalog
 from .public import router as public_router
 from .admin import router as admin_router
@@ -43,6 +44,14 @@ async def expire_loop(bot: Bot):
             logging.exception("expire_loop error: %s", e)
         await asyncio.sleep(30)
 
+async def optimize_loop():
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            await asyncio.to_thread(optimize_db)
+        except Exception as e:
+            logging.exception("optimize_loop error: %s", e)
+
 async def main():
     init_db()
     seed_default_catalog()
@@ -56,8 +65,10 @@ async def main():
 
     # تسک انقضا
     asyncio.create_task(expire_loop(bot))
+    # آمار برنامه‌ریز SQLite
+    asyncio.create_task(optimize_loop())
 
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    uvloop.run(main())
@@ -4,7 +4,8 @@ from typing import Iterable
 
 from .catalog import get_variant, list_admin_rows
 from .db import (
-    create_product,
+    ProductSpec,
+    create_products_bulk,
     delete_product,
     get_product,
     list_all_products,
@@ -40,23 +41,33 @@ def seed_default_catalog() -> None:
     if list_all_products():
         return
 
-    # Create top-level groups based on legacy admin rows
-    group_ids: dict[str, int] = {}
-    for idx, row in enumerate(list_admin_rows(), start=1):
-        title = str(row.get("title") or row.get("code") or f"دسته {idx}")
-        group_ids[row["code"]] = create_product(title, is_category=True, sort_order=idx)
-
+    # Create top-level groups based on legacy admin rows, then all their variants
+    admin_rows = list_admin_rows()
+    group_ids = create_products_bulk(
+        ProductSpec(
+            title=str(row.get("title") or row.get("code") or f"دسته {idx}"),
+            is_category=True,
+            sort_order=idx,
+        )
+        for idx, row in enumerate(admin_rows, start=1)
+    )
+
+    variants = []
+    for group_id, row in zip(group_ids, admin_rows):
         for position, variant_meta in enumerate(row.get("variants", []), start=1):
-            variant = get_variant(variant_meta["code"])
-            create_product(
-                variant["display_name"],
-                is_category=False,
-                parent_id=group_ids[row["code"]],
-                price=int(variant.get("amount") or 0),
-                available=bool(variant.get("available")),
-                description="",
-                sort_order=position,
+            variant = get_variant(variant_meta.code)
+            variants.append(
+                ProductSpec(
+                    title=variant.display_name,
+                    is_category=False,
+                    parent_id=group_id,
+                    price=variant.amount,
+                    available=variant.available,
+                    description="",
+                    sort_order=position,
+                )
             )
+    create_products_bulk(variants)
 
 
 def get_admin_tree() -> list[dict]:
@@ -367,7 +367,7 @@ async def cb_wallet_confirm(callback: CallbackQuery, state: FSMContext) -> None:
     if int(user["wallet_balance"]) < amount:
         await callback.answer("موجودی کیف پول کافی نیست.", show_alert=True)
         return
-    if not change_wallet(callback.from_user.id, -amount, "DEBIT", note=f"Order #{order_id}", order_id=order_id):
+    if not change_wallet(callback.from_user.id, -amount, "DEBIT", note=f"Order #{order_id}", order_id=order_id)[0]:
         await callback.answer("عدم امکان کسر از کیف پول.", show_alert=True)
         return
     comment = data.get("wallet_comment") or ""
@@ -609,7 +609,7 @@ async def on_mixed_amount(message: Message, state: FSMContext) -> None:
         "RESERVE",
         note=f"Reserve for order #{order_id}",
         order_id=order_id,
-    ):
+    )[0]:
         await message.answer("امکان رزرو کیف پول نیست.")
         return
     set_order_wallet_reserved(order_id, amt_wallet)
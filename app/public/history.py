@@ -5,7 +5,7 @@ from aiogram.types import CallbackQuery
 from . import router
 from .helpers import _fmt_order_for_user
 from ..config import CURRENCY
-from ..db import count_orders_by_category, get_user_stats, list_orders_by_category
+from ..db import get_user_stats, list_orders_by_category_with_total
 from ..keyboards import ik_history_menu, ik_history_more, ik_profile_actions
 
 
@@ -44,8 +44,9 @@ async def cb_hist_show(callback: CallbackQuery, state: FSMContext) -> None:
         "all": "📚 تمام سفارشات",
     }.get(category, category)
 
-    total = count_orders_by_category(callback.from_user.id, category)
-    rows = list_orders_by_category(callback.from_user.id, category, limit=page_size, offset=offset)
+    rows, total = list_orders_by_category_with_total(
+        callback.from_user.id, category, limit=page_size, offset=offset
+    )
 
     if page == 1:
         await callback.message.answer(f"{category_label} — مجموع: {total}")
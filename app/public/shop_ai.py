@@ -3,7 +3,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 
 from . import router
-from ..catalog import AI_VARIANT_MAP, get_variant
+from ..catalog import AI_VARIANT_MAP, VariantView, get_variant
 from ..config import AI_PLANS, CURRENCY
 from ..db import create_order, ensure_user, get_user
 from ..keyboards import ik_ai_buy_modes, ik_ai_confirm_purchase, ik_ai_main, ik_cart_actions, reply_main
@@ -35,7 +35,7 @@ def _ai_plan_description(code: str) -> str:
     return f"<b>{plan['title']}</b>\n\n{plan['desc']}"
 
 
-def _variant_data(plan_code: str, mode: str) -> dict[str, object]:
+def _variant_data(plan_code: str, mode: str) -> VariantView:
     try:
         variant_code = AI_VARIANT_MAP[plan_code][mode]
     except KeyError as exc:
@@ -47,12 +47,12 @@ def _mode_buttons(plan_code: str) -> list[dict[str, str]]:
     items: list[dict[str, str]] = []
     for mode, variant_code in AI_VARIANT_MAP.get(plan_code, {}).items():
         variant = get_variant(variant_code)
-        if variant["available"]:
+        if variant.available:
             callback = f"ai:{plan_code}:mode:{mode}"
-            text = variant["button_label"]
+            text = variant.button_label
         else:
             callback = f"ai:{plan_code}:mode:{mode}:unavailable"
-            text = variant["unavailable_label"]
+            text = variant.unavailable_label
         items.append({"mode": mode, "callback": callback, "text": text})
     return items
 
@@ -70,20 +70,20 @@ def _mode_label(mode: str) -> str:
     }.get(mode, mode)
 
 
-def _unavailable_text(variant: dict[str, object]) -> str:
-    label = str(variant.get("unavailable_label") or "")
+def _unavailable_text(variant: VariantView) -> str:
+    label = variant.unavailable_label
     if "به‌زودی" in label:
         return "این گزینه به‌زودی فعال می‌شود."
     return "این گزینه در حال حاضر ناموجود است."
 
 
-async def _alert_unavailable(callback: CallbackQuery, variant: dict[str, object]) -> None:
+async def _alert_unavailable(callback: CallbackQuery, variant: VariantView) -> None:
     text = _unavailable_text(variant)
     await callback.answer(text, show_alert=True)
     await callback.message.answer(text, reply_markup=reply_main())
 
 
-async def _message_unavailable(message: Message, variant: dict[str, object]) -> None:
+async def _message_unavailable(message: Message, variant: VariantView) -> None:
     await message.answer(_unavailable_text(variant), reply_markup=reply_main())
 
 
@@ -165,10 +165,10 @@ async def cb_ai_google_mode_pre_back(callback: CallbackQuery, state: FSMContext)
 @router.callback_query(F.data == "ai:team:mode:my")
 async def cb_ai_team_mode_my(callback: CallbackQuery, state: FSMContext) -> None:
     variant = _variant_data("team", "my")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_unavailable(callback, variant)
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     description = _ai_plan_description("team")
     price_line = _price_line(amount)
     await callback.message.answer(
@@ -190,11 +190,11 @@ async def on_ai_team_email(message: Message, state: FSMContext) -> None:
         message.from_user.first_name or "",
     )
     variant = _variant_data("team", "my")
-    if not variant["available"]:
+    if not variant.available:
         await _message_unavailable(message, variant)
         await state.clear()
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     if amount <= 0:
         await message.answer("قیمت این سرویس هنوز تنظیم نشده است.", reply_markup=reply_main())
         await state.clear()
@@ -222,10 +222,10 @@ async def on_ai_team_email(message: Message, state: FSMContext) -> None:
 @router.callback_query(F.data == "ai:team:mode:pre")
 async def cb_ai_team_mode_pre(callback: CallbackQuery, state: FSMContext) -> None:
     variant = _variant_data("team", "pre")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_unavailable(callback, variant)
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     description = _ai_plan_description("team")
     price_line = _price_line(amount)
     await callback.message.answer(
@@ -238,10 +238,10 @@ async def cb_ai_team_mode_pre(callback: CallbackQuery, state: FSMContext) -> Non
 @router.callback_query(F.data == "ai:team:mode:my:buy")
 async def cb_ai_team_mode_my_buy(callback: CallbackQuery, state: FSMContext) -> None:
     variant = _variant_data("team", "my")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_unavailable(callback, variant)
         return
-    if int(variant["amount"]) <= 0:
+    if variant.amount <= 0:
         await callback.message.answer("قیمت این سرویس هنوز تنظیم نشده است.", reply_markup=reply_main())
         await callback.answer()
         return
@@ -255,10 +255,10 @@ async def cb_ai_team_mode_my_buy(callback: CallbackQuery, state: FSMContext) ->
 async def cb_ai_team_mode_pre_buy(callback: CallbackQuery, state: FSMContext) -> None:
     ensure_user(callback.from_user.id, callback.from_user.username, callback.from_user.first_name or "")
     variant = _variant_data("team", "pre")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_unavailable(callback, variant)
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     if amount <= 0:
         await callback.message.answer("قیمت این سرویس هنوز تنظیم نشده است.", reply_markup=reply_main())
         await callback.answer()
@@ -286,10 +286,10 @@ async def cb_ai_team_mode_pre_buy(callback: CallbackQuery, state: FSMContext) ->
 @router.callback_query(F.data == "ai:plus:mode:my")
 async def cb_ai_plus_mode_my(callback: CallbackQuery, state: FSMContext) -> None:
     variant = _variant_data("plus", "my")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_unavailable(callback, variant)
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     description = _ai_plan_description("plus")
     price_line = _price_line(amount)
     await callback.message.answer(
@@ -323,11 +323,11 @@ async def on_ai_plus_password(message: Message, state: FSMContext) -> None:
     )
     data = await state.get_data()
     variant = _variant_data("plus", "my")
-    if not variant["available"]:
+    if not variant.available:
         await _message_unavailable(message, variant)
         await state.clear()
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     if amount <= 0:
         await message.answer("قیمت این سرویس هنوز تنظیم نشده است.", reply_markup=reply_main())
         await state.clear()
@@ -356,10 +356,10 @@ async def on_ai_plus_password(message: Message, state: FSMContext) -> None:
 @router.callback_query(F.data == "ai:plus:mode:pre")
 async def cb_ai_plus_mode_pre(callback: CallbackQuery, state: FSMContext) -> None:
     variant = _variant_data("plus", "pre")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_unavailable(callback, variant)
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     description = _ai_plan_description("plus")
     price_line = _price_line(amount)
     await callback.message.answer(
@@ -372,10 +372,10 @@ async def cb_ai_plus_mode_pre(callback: CallbackQuery, state: FSMContext) -> Non
 @router.callback_query(F.data == "ai:plus:mode:my:buy")
 async def cb_ai_plus_mode_my_buy(callback: CallbackQuery, state: FSMContext) -> None:
     variant = _variant_data("plus", "my")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_unavailable(callback, variant)
         return
-    if int(variant["amount"]) <= 0:
+    if variant.amount <= 0:
         await callback.message.answer("قیمت این سرویس هنوز تنظیم نشده است.", reply_markup=reply_main())
         await callback.answer()
         return
@@ -389,10 +389,10 @@ async def cb_ai_plus_mode_my_buy(callback: CallbackQuery, state: FSMContext) ->
 async def cb_ai_plus_mode_pre_buy(callback: CallbackQuery, state: FSMContext) -> None:
     ensure_user(callback.from_user.id, callback.from_user.username, callback.from_user.first_name or "")
     variant = _variant_data("plus", "pre")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_unavailable(callback, variant)
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     if amount <= 0:
         await callback.message.answer("قیمت این سرویس هنوز تنظیم نشده است.", reply_markup=reply_main())
         await callback.answer()
@@ -420,10 +420,10 @@ async def cb_ai_plus_mode_pre_buy(callback: CallbackQuery, state: FSMContext) ->
 @router.callback_query(F.data == "ai:google:mode:pre")
 async def cb_ai_google_mode_pre(callback: CallbackQuery, state: FSMContext) -> None:
     variant = _variant_data("google", "pre")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_unavailable(callback, variant)
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     description = _ai_plan_description("google")
     price_line = _price_line(amount)
     await callback.message.answer(
@@ -437,10 +437,10 @@ async def cb_ai_google_mode_pre(callback: CallbackQuery, state: FSMContext) -> N
 async def cb_ai_google_mode_pre_buy(callback: CallbackQuery, state: FSMContext) -> None:
     ensure_user(callback.from_user.id, callback.from_user.username, callback.from_user.first_name or "")
     variant = _variant_data("google", "pre")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_unavailable(callback, variant)
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     if amount <= 0:
         await callback.message.answer("قیمت این سرویس هنوز تنظیم نشده است.", reply_markup=reply_main())
         await callback.answer()
@@ -4,7 +4,7 @@ from aiogram.types import CallbackQuery, Message
 
 from . import router
 from .helpers import _order_title
-from ..catalog import TG_PREMIUM_VARIANTS, get_variant
+from ..catalog import TG_PREMIUM_VARIANTS, VariantView, get_variant
 from ..config import ADMIN_IDS, CURRENCY, TG_READY_PREBUILT
 from ..db import create_order, create_service_message, ensure_user, get_user
 from ..keyboards import (
@@ -19,14 +19,14 @@ from ..states import ShopStates
 from ..utils import is_valid_tg_id, mention
 
 
-def _premium_variant(period: str) -> dict[str, object]:
+def _premium_variant(period: str) -> VariantView:
     return get_variant(TG_PREMIUM_VARIANTS[period])
 
 
-def _format_variant_price(variant: dict[str, object]) -> str:
-    if not variant["available"]:
+def _format_variant_price(variant: VariantView) -> str:
+    if not variant.available:
         return "ناموجود"
-    amount = int(variant["amount"])
+    amount = variant.amount
     if amount <= 0:
         return "قیمت تنظیم نشده"
     return f"{amount} {CURRENCY}"
@@ -74,10 +74,10 @@ async def cb_tg_premium(callback: CallbackQuery, state: FSMContext) -> None:
 async def cb_tg_premium_choose(callback: CallbackQuery, state: FSMContext) -> None:
     period = callback.data.split(":")[2]
     variant = _premium_variant(period)
-    if not variant["available"]:
+    if not variant.available:
         await _alert_variant_unavailable(callback)
         return
-    if int(variant["amount"]) <= 0:
+    if variant.amount <= 0:
         await callback.message.answer("قیمت این سرویس هنوز تنظیم نشده است.", reply_markup=reply_main())
         await callback.answer()
         return
@@ -102,11 +102,11 @@ async def on_tg_premium_id(message: Message, state: FSMContext) -> None:
     code = data.get("pending_code")
     period = code.split("_")[1]
     variant = _premium_variant(period)
-    if not variant["available"]:
+    if not variant.available:
         await _message_variant_unavailable(message)
         await state.clear()
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     if amount <= 0:
         await message.answer("قیمت این سرویس هنوز تنظیم نشده است.", reply_markup=reply_main())
         await state.clear()
@@ -148,7 +148,7 @@ async def cb_tg_ready(callback: CallbackQuery, state: FSMContext) -> None:
 async def cb_tg_ready_pre(callback: CallbackQuery, state: FSMContext) -> None:
     item = TG_READY_PREBUILT
     variant = get_variant("tg_ready_pre")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_variant_unavailable(callback)
         return
     price_display = _format_variant_price(variant)
@@ -195,10 +195,10 @@ async def on_ready_country_text(message: Message, state: FSMContext) -> None:
 async def cb_tg_ready_pre_buy(callback: CallbackQuery, state: FSMContext) -> None:
     ensure_user(callback.from_user.id, callback.from_user.username, callback.from_user.first_name or "")
     variant = get_variant("tg_ready_pre")
-    if not variant["available"]:
+    if not variant.available:
         await _alert_variant_unavailable(callback)
         return
-    amount = int(variant["amount"])
+    amount = variant.amount
     if amount <= 0:
         await callback.message.answer("قیمت این سرویس هنوز تنظیم نشده است.", reply_markup=reply_main())
         await callback.answer()
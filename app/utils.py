@@ -1,6 +1,6 @@
 import re
 
-def is_admin(uid: int, admin_ids: list[int]) -> bool:
+def is_admin(uid: int, admin_ids: frozenset[int]) -> bool:
     return uid in admin_ids
 
 def mention(u) -> str:
@@ -23,8 +23,6 @@ from ..db import (
     ORDER_STATUS_LABELS,
     PAYMENT_TYPE_LABELS,
     change_wallet,
-    count_orders,
-    count_users,
     get_dashboard_snapshot,
     get_order,
     get_user,
@@ -32,13 +30,14 @@ from ..db import (
     get_wallet_summary,
     init_db,
     list_orders,
+    list_orders_with_total,
     list_recent_orders,
     list_recent_users,
     list_recent_wallet_tx,
-    list_users,
+    list_users_with_total,
     list_wallet_tx_for_order,
     list_wallet_tx_for_user,
-    list_service_messages,
+    list_service_messages_with_total,
     create_discount,
     delete_discount,
     get_discount,
@@ -73,6 +72,7 @@ from ..db import (
     update_product,
     set_order_financials,
     has_sort_conflict,
+    db_transaction,
 )
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -320,11 +320,15 @@ def create_admin_app() -> FastAPI:
         page: int = Query(1, ge=1),
     ):
         per_page = 20
-        total = count_orders(status=status_filter, search=q or None)
+        items, total = list_orders_with_total(
+            status=status_filter, search=q or None, limit=per_page, offset=(page - 1) * per_page
+        )
         pages = max((total + per_page - 1) // per_page, 1)
-        page = min(page, pages)
-        offset = (page - 1) * per_page
-        items = list_orders(status=status_filter, search=q or None, limit=per_page, offset=offset)
+        if page > pages:
+            page = pages
+            items, total = list_orders_with_total(
+                status=status_filter, search=q or None, limit=per_page, offset=(page - 1) * per_page
+            )
         return _render(
             request,
             "orders.html",
@@ -351,11 +355,15 @@ def create_admin_app() -> FastAPI:
     ):
         per_page = 20
         filter_value = None if category == "all" else category
-        total = count_service_messages(filter_value)
+        items, total = list_service_messages_with_total(
+            category=filter_value, limit=per_page, offset=(page - 1) * per_page
+        )
         pages = max((total + per_page - 1) // per_page, 1)
-        page = min(page, pages)
-        offset = (page - 1) * per_page
-        items = list_service_messages(category=filter_value, limit=per_page, offset=offset)
+        if page > pages:
+            page = pages
+            items, total = list_service_messages_with_total(
+                category=filter_value, limit=per_page, offset=(page - 1) * per_page
+            )
         return _render(
             request,
             "messages.html",
@@ -612,9 +620,8 @@ def create_admin_app() -> FastAPI:
         product_id: int,
         user: str = Depends(_login_required),
     ):
-        if not get_product(product_id):
+        if not delete_product(product_id):
             raise HTTPException(status.HTTP_404_NOT_FOUND, detail="محصول یافت نشد")
-        delete_product(product_id)
         _flash(request, "محصول/دسته حذف شد.")
         return RedirectResponse(request.url_for("products_page"), status.HTTP_303_SEE_OTHER)
 
@@ -748,27 +755,29 @@ def create_admin_app() -> FastAPI:
                 )
             )
 
-        for payload in pending:
-            update_product(
-                payload["pid"],
-                title=payload["title"],
-                parent_id=payload["parent_id"],
-                price=payload["price"],
-                available=payload["available"],
-                description=payload["description"],
-                request_only=payload["request_only"],
-                account_enabled=payload["account_enabled"],
-                self_available=payload["self_available"],
-                self_price=payload["self_price"],
-                pre_available=payload["pre_available"],
-                pre_price=payload["pre_price"],
-                require_username=payload["require_username"],
-                require_password=payload["require_password"],
-                allow_first_plan=payload["allow_first_plan"],
-                cashback_enabled=payload["cashback_enabled"],
-                cashback_percent=payload["cashback_percent"],
-                sort_order=payload["sort_order"],
-            )
+        # one commit for the whole form instead of one per product
+        with db_transaction():
+            for payload in pending:
+                update_product(
+                    payload["pid"],
+                    title=payload["title"],
+                    parent_id=payload["parent_id"],
+                    price=payload["price"],
+                    available=payload["available"],
+                    description=payload["description"],
+                    request_only=payload["request_only"],
+                    account_enabled=payload["account_enabled"],
+                    self_available=payload["self_available"],
+                    self_price=payload["self_price"],
+                    pre_available=payload["pre_available"],
+                    pre_price=payload["pre_price"],
+                    require_username=payload["require_username"],
+                    require_password=payload["require_password"],
+                    allow_first_plan=payload["allow_first_plan"],
+                    cashback_enabled=payload["cashback_enabled"],
+                    cashback_percent=payload["cashback_percent"],
+                    sort_order=payload["sort_order"],
+                )
 
         _flash(request, "تمام تغییرات ذخیره شد.")
         return RedirectResponse(request.url_for("products_page"), status.HTTP_303_SEE_OTHER)
@@ -1064,11 +1073,11 @@ def create_admin_app() -> FastAPI:
         page: int = Query(1, ge=1),
     ):
         per_page = 20
-        total = count_users(search=q or None)
+        items, total = list_users_with_total(search=q or None, limit=per_page, offset=(page - 1) * per_page)
         pages = max((total + per_page - 1) // per_page, 1)
-        page = min(page, pages)
-        offset = (page - 1) * per_page
-        items = list_users(search=q or None, limit=per_page, offset=offset)
+        if page > pages:
+            page = pages
+            items, total = list_users_with_total(search=q or None, limit=per_page, offset=(page - 1) * per_page)
         return _render(
             request,
             "users.html",
@@ -1150,13 +1159,11 @@ def create_admin_app() -> FastAPI:
             tx_type = "REFUND"
         elif action == "reserve":
             tx_type = "RESERVE"
-        success = change_wallet(user_id, delta, tx_type, note=note or "")
+        success, balance = change_wallet(user_id, delta, tx_type, note=note or "")
         if not success:
             _flash(request, "امکان اعمال تغییر وجود ندارد (موجودی کافی نیست؟)", "error")
         else:
             _flash(request, "تغییر موجودی با موفقیت ثبت شد.")
-            new_profile = get_user(user_id)
-            balance = int(new_profile.get("wallet_balance") if new_profile else 0)
             sign = "+" if delta > 0 else "-"
             await _notify_user(
                 user_id,